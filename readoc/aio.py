@@ -0,0 +1,45 @@
+from . import cli
+from .readoc import Document
+from .stdio import Decoder, sniff
+
+
+async def lines(reader, encoding=None, block=1 << 16):
+    # Lines of an asyncio.StreamReader, decoded and split as stdio.Reader
+    # does it.
+    head = b''
+    while len(head) < 3:
+        more = await reader.read(block)
+        if not more:
+            break
+        head += more
+
+    skip = 0
+    if encoding is None:
+        encoding, skip = sniff(head)
+    decoder = Decoder(encoding)
+    data = head[skip:]
+    final = not head
+    while True:
+        decoder.decode(data, final)
+        while decoder.lines:
+            yield decoder.lines.popleft()
+        if final:
+            return
+        data = await reader.read(block)
+        final = not data
+
+
+async def events(reader, coalesce=False):
+    doc = Document(None, coalesce)
+    async for line in lines(reader):
+        for e in doc.feed(line):
+            yield e
+    for e in doc.feed(''):
+        yield e
+
+
+async def render(fmt, reader, out, workers=None):
+    # e.g. await render('html', reader, out) with an asyncio.StreamReader
+    # and any text output with a write() method
+    stream = cli.FORMATS[fmt][0](events(reader, coalesce=True))
+    await stream.adump(out, workers)
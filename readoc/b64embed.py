@@ -1,28 +1,73 @@
-from .embed import filename, accept
+from .embed import accept
+from .cache import cache
 
-from base64 import b64decode
+import mimetypes
+from binascii import a2b_base64
 
-import os.path
 
-
-def base64(fmts, headers, body):
+def _format(fmts, headers):
     content = ()
     for h in headers:
         if h.key.lower() == 'format':
             content = h.values
             break
+    return accept(fmts, *content)
+
 
-    fmt = accept(fmts, *content)
-    fname = filename('base64', fmt, body)
-    if not os.path.exists(fname):
-        with open(fname, 'wb') as fp:
-            for part in body:
-                fp.write(b64decode(part))
+def _decode(body, block=1 << 16):
+    # Decodes the body in blocks of whole 4 character quanta, so lines may
+    # be split anywhere.
+    pending = []
+    size = 0
+    rest = ''
+    for part in body:
+        pending.append(part)
+        size += len(part)
+        if size >= block:
+            text = rest + ''.join(''.join(pending).split())
+            end = len(text) & ~3
+            yield a2b_base64(text[:end])
+            rest = text[end:]
+            pending = []
+            size = 0
+    text = rest + ''.join(''.join(pending).split())
+    if text:
+        yield a2b_base64(text)
 
+
+def base64(fmts, headers, body):
+    fmt = _format(fmts, headers)
+    # named after the text, so that a rendered embed costs a hash of it and
+    # is only decoded when missing
+    fname = cache.path('base64', fmt, body, headers)
+    if cache.lookup(fname):
+        return fmt, fname
+    tmp = cache.temporary(fname)
+    try:
+        with open(tmp, 'wb') as fp:
+            fp.writelines(_decode(body))
+    except BaseException:
+        cache.discard(tmp)
+        raise
+    cache.commit(tmp, fname)
     return fmt, fname
 
 
+def inline(fmts, headers, body):
+    # The body as a data: URI, nothing is decoded or written
+    fmt = _format(fmts, headers)
+    mime = mimetypes.guess_type('embed.' + fmt)[0]
+    return fmt, 'data:%s;base64,%s' % (mime or 'application/octet-stream',
+                                       ''.join(''.join(body).split()))
+
+
 EMBED = {
     "base64": base64,
     "b64": base64
 }
+
+# Alternatives for renderers that can take the content itself
+INLINE = {
+    "base64": inline,
+    "b64": inline
+}
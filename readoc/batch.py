@@ -0,0 +1,242 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import cli, plugins
+from .cache import cache, fingerprint, sources, unchanged
+from .profiling import Profile
+
+MANIFEST = '.readoc-manifest.json'
+
+# Outputs are rendered by these, outputs of an older readoc are stale
+_CODE = ('readoc.py', 'tags.py', 'stdio.py', 'stream.py', 'cli.py',
+         'html.py', 'latex.py', 'normalize.py', 'images.py', 'plugins.py',
+         'embed.py', 'b64embed.py', 'fileembed.py', 'graphviz.py',
+         'plantuml.py')
+
+
+def inputs(args):
+    seen = set()
+    for arg in args:
+        if arg.startswith('@'):
+            with open(arg[1:]) as fp:
+                paths = [ln.strip() for ln in fp]
+            paths = [p for p in paths if p and not p.startswith('#')]
+        elif glob.has_magic(arg):
+            paths = sorted(glob.glob(arg, recursive=True))
+        else:
+            paths = [arg]
+        for p in paths:
+            if p not in seen:
+                seen.add(p)
+                yield p
+
+
+def output(src, outdir, root, suffix):
+    rel = os.path.relpath(src, root)
+    if rel.startswith(os.pardir):
+        rel = os.path.basename(src)
+    return os.path.join(outdir, os.path.splitext(rel)[0] + suffix)
+
+
+def fresh(entry, fmt, src, dst):
+    return (entry is not None and entry['options'] == fmt and
+            entry['input'] == src and
+            entry.get('code') == sources(*_CODE) and os.path.exists(dst) and
+            unchanged(src, entry['source']) and
+            all(unchanged(p, fp) for p, fp in entry['deps'].items()))
+
+
+def job(fmt, src, dst, track=False, profile=False):
+    start = time.time()
+    result = {'input': src, 'output': dst, 'error': None, 'entry': None,
+              'profile': None}
+    try:
+        directory = os.path.dirname(dst)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        prof = Profile() if profile else None
+        with plugins.record() as deps:
+            cli.render(fmt, src, dst, prof)
+        if track:
+            result['entry'] = {
+                'options': fmt,
+                'input': src,
+                'code': sources(*_CODE),
+                'source': fingerprint(src),
+                'deps': {p: fingerprint(p) for p in sorted(deps)
+                         if os.path.exists(p)},
+            }
+        if prof:
+            result['profile'] = prof.report()
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        # pool workers exit without running atexit handlers
+        cache.flush()
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _load(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(path, manifest):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def run(fmt, jobs, outdir, root, paths, incremental=False, profile=None,
+        report=sys.stderr):
+    start = time.time()
+    suffix = cli.FORMATS[fmt][1]
+    work = [(src, output(src, outdir, root, suffix)) for src in paths]
+
+    manifest = None
+    if incremental:
+        manifest = _load(os.path.join(outdir, MANIFEST))
+        stale = [(src, dst) for src, dst in work
+                 if not fresh(manifest.get(dst), fmt, src, dst)]
+        report.write('%d of %d documents up to date\n' %
+                     (len(work) - len(stale), len(work)))
+        work = stale
+
+    args = (incremental, bool(profile))
+    pool = None
+    if jobs == 1 or len(work) <= 1:
+        results = (job(fmt, src, dst, *args) for src, dst in work)
+    else:
+        pool = ProcessPoolExecutor(jobs)
+        futures = [pool.submit(job, fmt, src, dst, *args)
+                   for src, dst in work]
+        results = (f.result() for f in as_completed(futures))
+
+    profiles = {} if profile else None
+    try:
+        failed = _report(results, report, start, manifest, profiles)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    if manifest is not None:
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        _save(os.path.join(outdir, MANIFEST), manifest)
+    if profile:
+        with open(profile, 'w') as fp:
+            json.dump(profiles, fp, indent=1)
+    return failed
+
+
+def watch(fmt, jobs, outdir, root, paths, profile=None, report=sys.stderr,
+          delay=0.1, poll=False):
+    # Render everything that is out of date, then render again whenever an
+    # input or one of its dependencies changes. Renders after the first run
+    # in this process, so plugin servers and caches stay warm.
+    from .watch import Watcher
+    with Watcher(delay, poll=poll) as watcher:
+        # watching before the first run, so that inputs saved while it runs
+        # are rendered again
+        deps = _deps(outdir, paths)
+        watcher.watch(set(paths).union(*deps.values()))
+        run(fmt, jobs, outdir, root, paths, True, profile, report)
+        while True:
+            deps = _deps(outdir, paths)
+            watcher.watch(set(paths).union(*deps.values()))
+            changed = watcher.wait()
+            if not changed:
+                continue
+            # fresh() skips those saved without changing their content
+            stale = [src for src in paths
+                     if src in changed or deps[src] & changed]
+            if stale:
+                run(fmt, 1, outdir, root, stale, True, profile, report)
+
+
+def _deps(outdir, paths):
+    # The files each input was last rendered from, as in the manifest
+    deps = {src: set() for src in paths}
+    for entry in _load(os.path.join(outdir, MANIFEST)).values():
+        if entry['input'] in deps:
+            deps[entry['input']].update(entry['deps'])
+    return deps
+
+
+def _report(results, report, start, manifest, profiles):
+    failed = 0
+    count = 0
+    for r in results:
+        count += 1
+        src, dst = r['input'], r['output']
+        if r['error']:
+            failed += 1
+            report.write('FAILED %s\n%s' % (src, r['error']))
+        else:
+            report.write('%8.3fs %s -> %s\n' % (r['seconds'], src, dst))
+        if manifest is not None:
+            if r['entry']:
+                manifest[dst] = r['entry']
+            else:
+                manifest.pop(dst, None)
+        if profiles is not None and r['profile']:
+            profiles[src] = r['profile']
+    report.write('%d documents, %d failed, %.3fs\n' %
+                 (count, failed, time.time() - start))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m readoc.batch',
+        description='Render many readoc documents in parallel.')
+    parser.add_argument('-f', '--format', choices=sorted(cli.FORMATS),
+                        default='html')
+    parser.add_argument('-o', '--output', default='.',
+                        help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--root', default='.',
+                        help='inputs keep their path relative to this '
+                        'directory in the output directory')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only render documents whose input, options or '
+                        'dependencies changed since the last build')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write JSON profiles of every render to FILE')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep running, rendering documents again when '
+                        'they or their dependencies change (implies -i)')
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, poll for changes rather than '
+                        'using inotify')
+    parser.add_argument('inputs', nargs='+',
+                        help='input files, glob patterns or @manifest files')
+    args = parser.parse_args(argv)
+
+    paths = list(inputs(args.inputs))
+    if args.watch:
+        try:
+            watch(args.format, max(args.jobs or 1, 1), args.output,
+                  args.root, paths, args.profile, poll=args.poll)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    failed = run(args.format, max(args.jobs or 1, 1), args.output, args.root,
+                 paths, args.incremental, args.profile)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from .. import plugins
+from ..readoc import Document
+from ..html import HTML
+from ..latex import Latex
+from ..normalize import Normalize
+from . import generate
+
+TARGETS = {
+    'parse': None,
+    'html': HTML,
+    'latex': Latex,
+    'normalize': Normalize,
+}
+
+_HEAD = '%-8s %7s %10s %-10s %9s %10s %12s %10s\n'
+_ROW = '%-8s %7d %10d %-10s %9.4f %10.2f %12.0f %10s\n'
+
+
+def _stub(fmts, headers, body):
+    for part in body:
+        pass
+    return fmts[0], 'bench-stub.' + fmts[0]
+
+
+def run(text, renderer, coalesce=False):
+    doc = Document(io.StringIO(text), coalesce)
+    if renderer is None:
+        for e in doc:
+            pass
+    else:
+        renderer(doc).dump(io.StringIO())
+
+
+def measure(text, renderer, repeat, memory, coalesce=False):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(text, renderer, coalesce)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        run(text, renderer, coalesce)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def bench(shapes, sizes, targets, repeat=3, memory=True, emphasis=0.1,
+          coalesce=False, report=sys.stdout):
+    results = []
+    report.write(_HEAD % (
+        'shape', 'size', 'bytes', 'target', 'seconds', 'MB/s', 'events/s',
+        'peak KB'))
+    for shape in shapes:
+        for size in sizes:
+            text = generate.document(size, shape, emphasis=emphasis)
+            events = sum(1 for _ in Document(io.StringIO(text), coalesce))
+            nbytes = len(text.encode('utf-8'))
+            for target in targets:
+                seconds, peak = measure(text, TARGETS[target], repeat,
+                                        memory, coalesce)
+                r = {
+                    'shape': shape,
+                    'size': size,
+                    'bytes': nbytes,
+                    'lines': text.count('\n'),
+                    'events': events,
+                    'target': target,
+                    'coalesce': coalesce,
+                    'seconds': seconds,
+                    'bytes_per_second': nbytes / seconds,
+                    'events_per_second': events / seconds,
+                    'peak_bytes': peak,
+                }
+                results.append(r)
+                report.write(_ROW % (
+                    shape, size, nbytes, target, seconds,
+                    r['bytes_per_second'] / 1e6, r['events_per_second'],
+                    '-' if peak is None else peak // 1024))
+    return results
+
+
+def compare(old, new, report=sys.stdout):
+    key = (lambda r: (r['shape'], r['size'], r['target']))
+    before = {key(r): r for r in old}
+    report.write('\n%-8s %7s %-10s %9s %9s %7s\n' % (
+        'shape', 'size', 'target', 'old', 'new', 'ratio'))
+    for r in new:
+        o = before.get(key(r))
+        if o:
+            report.write('%-8s %7d %-10s %9.4f %9.4f %7.2f\n' % (
+                r['shape'], r['size'], r['target'], o['seconds'],
+                r['seconds'], r['seconds'] / o['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m readoc.bench',
+        description='Time parsing and rendering of synthetic documents.')
+    parser.add_argument('--shapes', default=','.join(generate.SHAPES),
+                        help='comma separated, of: ' +
+                        ', '.join(generate.SHAPES))
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated document sizes (in blocks)')
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help='comma separated, of: ' + ', '.join(TARGETS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--emphasis', type=float, default=0.1,
+                        help='share of emphasised words')
+    parser.add_argument('--coalesce', action='store_true',
+                        help='parse with text coalescing enabled')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the (slow) peak memory measurement')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    # embeds go to a stub plugin, so only readoc itself is measured
+    plugins.EMBED[generate.STUB] = _stub
+
+    results = bench(args.shapes.split(','),
+                    [int(s) for s in args.sizes.split(',')],
+                    args.targets.split(','), args.repeat,
+                    not args.no_memory, args.emphasis, args.coalesce)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results,
+            }, fp, indent=1)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(json.load(fp)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
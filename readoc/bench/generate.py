@@ -0,0 +1,104 @@
+import random
+
+_WORDS = (
+    'the quick brown fox jumps over lazy dog readoc document format plain '
+    'text parser renderer section paragraph list item embedded diagram '
+    'property value canonical form white space column indentation marker'
+).split()
+
+STUB = 'bench'
+
+
+class Generator(object):
+    def __init__(self, seed=0, emphasis=0.1, width=72):
+        self.random = random.Random(seed)
+        self.emphasis = emphasis
+        self.width = width
+
+    def words(self, count):
+        r = self.random
+        out = []
+        for _ in range(count):
+            w = r.choice(_WORDS)
+            if r.random() < self.emphasis:
+                mark = r.choice(('*', '_', '**'))
+                w = mark + w + mark
+            out.append(w)
+        return out
+
+    def lines(self, count, indent):
+        # words wrapped at the configured width
+        words = self.words(count)
+        line = []
+        size = indent
+        for w in words:
+            if line and size + len(w) + 1 > self.width:
+                yield ' '*indent + ' '.join(line)
+                line = []
+                size = indent
+            line.append(w)
+            size += len(w) + 1
+        if line:
+            yield ' '*indent + ' '.join(line)
+
+    def paragraph(self, words=60):
+        return list(self.lines(words, 2)) + ['']
+
+    def listing(self, depth=4, items=3, indent=4):
+        out = []
+        ordered = self.random.random() < 0.5
+        for i in range(items):
+            lbl = '%d.' % (i+1) if ordered else '-'
+            first = True
+            for ln in self.lines(12, indent + len(lbl) + 1):
+                if first:
+                    ln = ' '*indent + lbl + ln[indent + len(lbl):]
+                    first = False
+                out.append(ln)
+            if depth > 1:
+                out.extend(self.listing(depth-1, items, indent+len(lbl)+1))
+        if indent == 4:
+            out.append('')
+        return out
+
+    def embed(self, lines=8):
+        out = ['  ----']
+        out.extend('  ' + ' '.join(self.words(6)) for _ in range(lines))
+        out.append('  ----')
+        out.append('  \\_:%s:_/          Figure: %s' %
+                   (STUB, ' '.join(self.words(4))))
+        out.append('')
+        return out
+
+    def document(self, size=100, shape='mixed'):
+        out = ['Author: Benchmark                        Date: Today', '',
+               '', '                 Synthetic Benchmark Document', '', '']
+        r = self.random
+        section = 0
+        for i in range(size):
+            kind = shape
+            if shape == 'mixed':
+                kind = r.choice(('prose', 'lists', 'headers', 'embeds'))
+            if kind == 'headers' or i % 10 == 0:
+                section += 1
+                out.append('%d Section %s' % (section, self.words(1)[0]))
+                out.append('')
+                for sub in range(1, 4 if kind == 'headers' else 1):
+                    out.append('%d.%d Sub' % (section, sub))
+                    out.append('')
+            if kind == 'prose':
+                out.extend(self.paragraph(r.randint(40, 400)))
+            elif kind == 'lists':
+                out.extend(self.listing())
+            elif kind == 'embeds':
+                out.extend(self.embed())
+            else:
+                out.extend(self.paragraph(20))
+        return '\n'.join(out) + '\n'
+
+
+SHAPES = ('mixed', 'prose', 'lists', 'headers', 'embeds')
+
+
+def document(size=100, shape='mixed', seed=0, emphasis=0.1):
+    return Generator(seed, emphasis).document(size, shape)
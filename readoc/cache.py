@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import profiling
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Headers that only affect presentation (captions, the size an image is
+# shown at), not the rendered file.
+_PRESENTATION = ('figure', 'listing', 'width', 'height', 'scale')
+
+# mkstemp creates private files, renders are published using the usual mode
+_umask = os.umask(0)
+os.umask(_umask)
+
+_units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+def size(value):
+    if not value:
+        return None
+    value = value.strip().lower()
+    scale = _units.get(value[-1])
+    if scale:
+        return int(value[:-1]) * scale
+    return int(value)
+
+
+_identities = {}
+
+
+def identity(path):
+    # Cheap stand-in for a tool version, changes whenever the tool binary
+    # is replaced. Bare names are looked up on PATH, and links followed to
+    # the installed binary (alternatives, JAVA_HOME/bin/java).
+    ident = _identities.get(path)
+    if ident is None:
+        real = os.path.realpath(shutil.which(path) or path)
+        try:
+            st = os.stat(real)
+            ident = '%s:%s:%d:%d' % (path, real, st.st_size, st.st_mtime)
+        except OSError:
+            ident = path
+        _identities[path] = ident
+    return ident
+
+
+def sources(*names):
+    # Identity of readoc modules, for results that depend on the code
+    here = os.path.dirname(os.path.abspath(__file__))
+    return ' '.join(identity(os.path.join(here, name)) for name in names)
+
+
+def digest(fp, block=1 << 16):
+    # SHA-1 of the rest of the binary stream fp, read in blocks
+    md = hashlib.sha1()
+    for data in iter(lambda: fp.read(block), b''):
+        md.update(data)
+    return md.hexdigest()
+
+
+def file_digest(path):
+    with open(path, 'rb') as fp:
+        return digest(fp)
+
+
+def _stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def fingerprint(path):
+    return _stat(path) + [file_digest(path)]
+
+
+def unchanged(path, fp):
+    # Compare size and mtime first, only hash when those differ
+    try:
+        st = _stat(path)
+    except OSError:
+        return False
+    if st == fp[:2]:
+        return True
+    if st[0] != fp[0] or file_digest(path) != fp[2]:
+        return False
+    fp[:2] = st
+    return True
+
+
+class _Locked(object):
+    # Exclusive lock on a file, held across processes sharing a directory
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Cache(object):
+    INDEX = 'readoc-cache.json'
+    LOCK = 'readoc-cache.lock'
+
+    def __init__(self, directory='', max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.flushed = (0, 0)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+
+    def path(self, mode, suffix, body, headers=(), tool=()):
+        md = hashlib.md5()
+        for part in body:
+            md.update(part.encode('utf-8'))
+        return self.named(mode, suffix, md, headers, tool)
+
+    def named(self, mode, suffix, md, headers=(), tool=()):
+        # path() for a body already fed to the md5 object md
+        for h in headers:
+            if h.key.lower() in _PRESENTATION:
+                continue
+            md.update(b'\0')
+            md.update('\0'.join([h.key] + h.values).encode('utf-8'))
+        for t in tool:
+            md.update(b'\1')
+            md.update(t.encode('utf-8'))
+
+        return os.path.join(self.directory,
+                            mode + '-' + md.hexdigest() + '.' + suffix)
+
+    def lookup(self, path):
+        # Entries are only ever renamed into place once complete, so
+        # existence means a usable render.
+        hit = os.path.exists(path)
+        profiling.note(cache='hit' if hit else 'miss')
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self._touch(path)
+            else:
+                self.misses += 1
+        return hit
+
+    def temporary(self, path):
+        directory = os.path.dirname(path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=directory, prefix='.tmp-', suffix='.' + path.rpartition('.')[2]
+        )
+        os.close(fd)
+        os.chmod(tmp, 0o666 & ~_umask)
+        return tmp
+
+    def commit(self, tmp, path):
+        os.replace(tmp, path)
+        with self.lock:
+            self._touch(path)
+
+    def discard(self, tmp):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+    def _touch(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self.entries[os.path.basename(path)] = [st.st_size, time.time()]
+        self.dirty = True
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX)) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def flush(self):
+        # The index is only kept for an explicitly configured directory, the
+        # default (current directory) stays free of bookkeeping files.
+        if not self.directory:
+            return
+        with self.lock:
+            hits = self.hits - self.flushed[0]
+            misses = self.misses - self.flushed[1]
+            if not (self.dirty or hits or misses):
+                return
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            # Other processes (batch workers, parallel builds) merge into
+            # the same index
+            with _Locked(os.path.join(self.directory, self.LOCK)):
+                index = self._read_index()
+                entries = index.get('entries', {})
+                for name, (sz, used) in self.entries.items():
+                    if name not in entries or entries[name][1] < used:
+                        entries[name] = [sz, used]
+                index['hits'] = index.get('hits', 0) + hits
+                index['misses'] = index.get('misses', 0) + misses
+                index['entries'] = entries
+                self._evict(entries)
+
+                index_path = os.path.join(self.directory, self.INDEX)
+                tmp = self.temporary(index_path)
+                with open(tmp, 'w') as fp:
+                    json.dump(index, fp)
+                os.replace(tmp, index_path)
+
+            self.entries = {}
+            self.dirty = False
+            self.flushed = (self.hits, self.misses)
+
+    def _evict(self, entries):
+        for name in list(entries):
+            if not os.path.exists(os.path.join(self.directory, name)):
+                del entries[name]
+        if self.max_size is None:
+            return
+        total = sum(sz for sz, used in entries.values())
+        for name, (sz, used) in sorted(entries.items(),
+                                       key=lambda e: e[1][1]):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= sz
+            del entries[name]
+
+
+cache = Cache(os.getenv('READOC_CACHE', ''),
+              size(os.getenv('READOC_CACHE_SIZE')))
+
+
+def configure(directory=None, max_size=None):
+    cache.flush()
+    if directory is not None:
+        cache.directory = directory
+    if max_size is not None:
+        cache.max_size = max_size
@@ -0,0 +1,128 @@
+import difflib
+import io
+import os
+import sys
+
+from . import cli
+from .cache import file_digest, sources
+from .readoc import Document
+from .stdio import Reader, Writer, sniff
+
+# Normalized output depends on these, known hashes are dropped if any of
+# them change.
+_SOURCES = ('readoc.py', 'normalize.py', 'stream.py', 'cli.py')
+
+
+class Mismatch(Exception):
+    pass
+
+
+class _Compare(object):
+    # Binary sink comparing whatever is written to it with a file, raising
+    # Mismatch at the first difference.
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, data):
+        if self.fp.read(len(data)) != data:
+            raise Mismatch()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.fp.read(1):
+            raise Mismatch()
+
+
+class Known(object):
+    def __init__(self, path):
+        self.path = path
+        self.version = sources(*_SOURCES)
+        self.hashes = set()
+        self.added = False
+        try:
+            with open(path) as fp:
+                if fp.readline().rstrip('\n') == self.version:
+                    self.hashes.update(ln.strip() for ln in fp)
+        except OSError:
+            pass
+
+    def __contains__(self, digest):
+        return digest in self.hashes
+
+    def add(self, digest):
+        self.hashes.add(digest)
+        self.added = True
+
+    def save(self):
+        if not self.added:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            fp.write(self.version + '\n')
+            for digest in sorted(self.hashes):
+                fp.write(digest + '\n')
+        os.replace(tmp, self.path)
+
+
+def canonical(path):
+    # The normalized text, in the encoding and with the byte order mark the
+    # file came with, is compared with the file.
+    with open(path, 'rb') as src, open(path, 'rb') as cmp:
+        encoding, skip = sniff(cmp.read(4))
+        cmp.seek(skip)
+        compare = _Compare(cmp)
+        readoc = Document(Reader(src), coalesce=True)
+        try:
+            with Writer(compare, encoding, size=1 << 12) as out:
+                cli.normalize(readoc).dump(out)
+            compare.close()
+        except Mismatch:
+            return False
+    return True
+
+
+def diff(path, out=sys.stdout):
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    encoding, skip = sniff(data[:4])
+    text = data[skip:].decode(encoding, 'replace')
+    rendered = io.StringIO()
+    cli.normalize(Document(Reader(io.BytesIO(data)), coalesce=True)).dump(
+        rendered)
+    out.writelines(difflib.unified_diff(
+        text.splitlines(True), rendered.getvalue().splitlines(True),
+        path, path + ' (normalized)'))
+
+
+def check(paths, show_diff=False, known=None, report=sys.stderr):
+    failed = 0
+    for path in paths:
+        digest = None
+        try:
+            if known is not None:
+                digest = file_digest(path)
+                if digest in known:
+                    continue
+            if canonical(path):
+                if known is not None:
+                    known.add(digest)
+                continue
+        except (OSError, UnicodeError) as e:
+            failed += 1
+            report.write('%s: %s\n' % (path, e))
+            continue
+        except Exception as e:
+            # a parser or renderer bug, the other files are still checked
+            failed += 1
+            report.write('%s: cannot be normalized: %s: %s\n' % (
+                path, type(e).__name__, e))
+            continue
+        failed += 1
+        report.write('%s is not in canonical form\n' % (path,))
+        if show_diff:
+            diff(path)
+    if known is not None:
+        known.save()
+    return failed
@@ -0,0 +1,102 @@
+import argparse
+import sys
+from contextlib import ExitStack
+
+from . import serial
+from .readoc import Document
+from .profiling import Profile
+from .stdio import Reader, Writer
+
+
+def html(readoc):
+    from .html import HTML
+    return HTML(readoc,
+                title='h1 class="title"',
+                subtitle='h1 class="subtitle"',
+                sectionlevel=1)
+
+
+def latex(readoc):
+    from .latex import Latex
+    return Latex(readoc, toc=True, def_headers='readoc@')
+
+
+def normalize(readoc):
+    from .normalize import Normalize
+    return Normalize(readoc, justify=None)
+
+
+# name: (renderer factory, output suffix)
+FORMATS = {
+    'html': (html, '.html'),
+    'latex': (latex, '.tex'),
+    'normalize': (normalize, '.txt'),
+}
+
+
+def render(fmt, src, dst, profile=None):
+    with open(src, 'rb') as fp, open(dst, 'wb') as raw:
+        readoc = serial.parse(fp, coalesce=True)
+        with Writer(raw) as out:
+            FORMATS[fmt][0](readoc).dump(out, profile=profile)
+
+
+def render_many(src, outputs, workers=None):
+    # Renders src once into every (format, destination) of outputs
+    from .stream import fanout
+    with open(src, 'rb') as fp, ExitStack() as stack:
+        readoc = serial.parse(fp, coalesce=True)
+        targets = []
+        for fmt, dst in outputs:
+            out = stack.enter_context(Writer(
+                stack.enter_context(open(dst, 'wb'))))
+            targets.append((FORMATS[fmt][0](None), out))
+        fanout(readoc, targets, workers)
+
+
+def write_profile(profile, path):
+    if path == '-':
+        profile.dump(sys.stderr)
+    else:
+        with open(path, 'w') as fp:
+            profile.dump(fp)
+
+
+KNOWN = '.readoc-canonical'
+
+
+def main(fmt, argv=None):
+    from . import stdio
+    parser = argparse.ArgumentParser(
+        prog='python -m readoc.' + fmt,
+        description='Render a readoc document from stdin to stdout.')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write a JSON profile of the render to FILE '
+                        '(- for stderr)')
+    if fmt == 'normalize':
+        parser.add_argument('--check', action='store_true',
+                            help='check that the given files are in '
+                            'canonical form instead, exit status 1 if not')
+        parser.add_argument('--diff', action='store_true',
+                            help='with --check, show the changes normalizing '
+                            'would make')
+        parser.add_argument('--known', default=KNOWN, metavar='FILE',
+                            help='with --check, file remembering inputs '
+                            'already found canonical (default %(default)s, '
+                            '- to disable)')
+        parser.add_argument('files', nargs='*')
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'check', False):
+        from .check import Known, check
+        known = Known(args.known) if args.known != '-' else None
+        sys.exit(1 if check(args.files, args.diff, known) else 0)
+    if getattr(args, 'files', None):
+        parser.error('input files are only accepted with --check')
+
+    profile = Profile() if args.profile else None
+    readoc = Document(Reader(stdio.stdin), coalesce=True)
+    with Writer(stdio.stdout) as out:
+        FORMATS[fmt][0](readoc).dump(out, profile=profile)
+    if profile:
+        write_profile(profile, args.profile)
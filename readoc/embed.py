@@ -1,39 +1,103 @@
-import hashlib
+import asyncio
+import contextvars
 import subprocess
 import sys
-import os.path
+from contextlib import contextmanager
 
+from .cache import cache
+from . import profiling
 
-def filename(mode, suffix, body):
-    md = hashlib.md5()
-    for part in body:
-        md.update(part.encode('utf-8'))
+# Renders held back while deferring, see deferred()
+_deferred = contextvars.ContextVar('readoc_deferred', default=None)
 
-    return mode + '-' + md.hexdigest() + '.' + suffix
 
+def filename(mode, suffix, body, headers=(), tool=()):
+    return cache.path(mode, suffix, body, headers, tool)
 
-def command(cmd, filename, body):
-    if os.path.exists(filename):
+
+def _render(cmd, filename, body, stdout):
+    if cache.lookup(filename):
         return
-    sub = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=sys.stderr)
+    jobs = _deferred.get()
+    if jobs is not None:
+        jobs.append((cmd, filename, body, stdout))
+        return
+    tmp = cache.temporary(filename)
+    try:
+        if stdout:
+            with open(tmp, 'wb') as fp:
+                sub = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fp,
+                                       stderr=sys.stderr)
+        else:
+            sub = subprocess.Popen(cmd + ['-o', tmp], stdin=subprocess.PIPE,
+                                   stderr=sys.stderr)
+
+        for part in body:
+            sub.stdin.write(part.encode('utf-8'))
+        sub.stdin.close()
+        status = sub.wait()
+    except BaseException:
+        cache.discard(tmp)
+        raise
+
+    profiling.note(status=status)
+    # Failed renders are not kept, so they are retried on the next run
+    if status == 0:
+        cache.commit(tmp, filename)
+    else:
+        cache.discard(tmp)
+
+
+@contextmanager
+def deferred():
+    # Plugins called within collect the commands they would run, to be run
+    # later with arender(), rather than running them.
+    jobs = []
+    token = _deferred.set(jobs)
+    try:
+        yield jobs
+    finally:
+        _deferred.reset(token)
+
 
-    for part in body:
-        sub.stdin.write(part.encode('utf-8'))
-    sub.stdin.close()
-    sub.wait()
+def deferring():
+    return _deferred.get() is not None
+
+
+async def arender(cmd, filename, body, stdout):
+    tmp = cache.temporary(filename)
+    try:
+        if stdout:
+            with open(tmp, 'wb') as fp:
+                sub = await asyncio.create_subprocess_exec(
+                    *cmd, stdin=subprocess.PIPE, stdout=fp, stderr=sys.stderr)
+        else:
+            sub = await asyncio.create_subprocess_exec(
+                *(cmd + ['-o', tmp]), stdin=subprocess.PIPE,
+                stderr=sys.stderr)
+
+        for part in body:
+            sub.stdin.write(part.encode('utf-8'))
+            await sub.stdin.drain()
+        sub.stdin.close()
+        status = await sub.wait()
+    except BaseException:
+        cache.discard(tmp)
+        raise
+
+    if status == 0:
+        cache.commit(tmp, filename)
+    else:
+        cache.discard(tmp)
+
+
+def command(cmd, filename, body):
+    # cmd writes to the file given using '-o'
+    _render(cmd, filename, body, False)
 
 
 def pipe(cmd, filename, body):
-    if os.path.exists(filename):
-        return
-    with open(filename, 'wb') as fp:
-        sub = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fp,
-                               stderr=sys.stderr)
-
-    for part in body:
-        sub.stdin.write(part.encode('utf-8'))
-    sub.stdin.close()
-    sub.wait()
+    _render(cmd, filename, body, True)
 
 
 def accept(fmts, *acc):
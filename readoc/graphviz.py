@@ -1,4 +1,5 @@
 from .embed import filename, command, accept
+from .cache import identity
 from functools import partial
 
 
@@ -8,15 +9,17 @@ def dot(mode, fmts, headers, body):
         'png', 'gif', 'jpg', 'jpeg'
     )
 
-    fname = filename(mode, fmt, body)
-    command(['/usr/bin/{}'.format(mode), '-T' + fmt, '-o', fname], fname, body)
+    tool = '/usr/bin/{}'.format(mode)
+    fname = filename(mode, fmt, body, headers, (identity(tool),))
+    command([tool, '-T' + fmt], fname, body)
     return fmt, fname
 
 
 def msc(fmts, headers, body):
     fmt = accept(fmts, 'eps', 'png', 'svg', 'ismap')
-    fname = filename('msc', fmt, body)
-    command(['/usr/bin/mscgen', '-T' + fmt, '-o', fname], fname, body)
+    tool = '/usr/bin/mscgen'
+    fname = filename('msc', fmt, body, headers, (identity(tool),))
+    command([tool, '-T' + fmt], fname, body)
     return fmt, fname
 
 
@@ -1,12 +1,65 @@
 from .stream import Stream
-from .readoc import Document
-from . import plugins
+from . import images, plugins
+
+from functools import partial
+import re
 
 _graphics = ('png', 'jpg', 'svg', 'gif')
 
+# Embed headers sizing images, as for Latex
+_dims = {'width': 0, 'height': 1, 'scale': 2}
+_length = re.compile(r'([0-9]*\.?[0-9]+)\s*'
+                     r'(px|%|em|rem|ex|ch|pt|pc|mm|cm|in|vw|vh|'
+                     r'\\textwidth|\\linewidth|\\columnwidth)?')
+
+
+def _css(value):
+    # A Latex length as CSS: pixels as an int, other units as a string
+    m = _length.fullmatch(value.strip())
+    if not m:
+        return None
+    number, unit = m.groups()
+    if not unit or unit == 'px':
+        return int(round(float(number)))
+    if unit.startswith('\\'):
+        return '%g%%' % (float(number) * 100)
+    return number + unit
+
+
+def _dimensions(natural, width, height, scale):
+    # Width and height attributes (the intrinsic size when known, which
+    # also gives the aspect ratio) and CSS for sizes given in other units.
+    w, h = natural or (None, None)
+    if scale and w and h:
+        try:
+            w, h = (int(round(float(scale) * n)) for n in (w, h))
+        except ValueError:
+            pass
+    width = _css(width) if width else None
+    height = _css(height) if height else None
+    if isinstance(width, int):
+        if h and w and not isinstance(height, int):
+            h = int(round(h * width / w))
+        w = width
+    if isinstance(height, int):
+        if w and h and not isinstance(width, int):
+            w = int(round(w * height / h))
+        h = height
+    style = []
+    if isinstance(width, str):
+        style.append('width: %s' % width)
+        if height is None:
+            style.append('height: auto')
+    if isinstance(height, str):
+        style.append('height: %s' % height)
+        if width is None:
+            style.append('width: auto')
+    return w, h, '; '.join(style)
+
 
 class HTML(Stream):
-    def __init__(self, readoc, title='h1', subtitle='h1', sectionlevel=2):
+    def __init__(self, readoc, title='h1', subtitle='h1', sectionlevel=2,
+                 inline=False):
         super(HTML, self).__init__(readoc)
         self.__level = 0
         self.__first = True
@@ -16,6 +69,8 @@ class HTML(Stream):
         self.__sectionlevel = sectionlevel
 
         self.__titled = False
+        # Embedded images as data: URIs rather than files, where possible
+        self.__inline = inline
 
     def title(self, text):
         if not self.__titled:
@@ -79,38 +134,48 @@ class HTML(Stream):
              ' '.join(values), '</div></div>')
         )
 
+    def _image(self, dims, fmt, fname):
+        if fmt not in _graphics:
+            return (fname, '?')
+        width, height, style = _dimensions(images.size(fname), *dims)
+        attrs = ''
+        if width:
+            attrs += ' width="%d"' % width
+        if height:
+            attrs += ' height="%d"' % height
+        if style:
+            attrs += ' style="%s"' % style
+        return ('<img src="', fname, '"', attrs,
+                ' loading="lazy" decoding="async"/>')
+
     def embed(self, lead, body, trail, headers):
         before = ()
         after = ()
-        plugin = plugins.embed(headers)
+        plugin = plugins.embed(headers, self.__inline)
+        dims = [None, None, None]
         for h in headers:
             if h.key.lower() == 'figure':
                 before, after = self._figure(h.values)
+            elif h.key.lower() in _dims:
+                dims[_dims[h.key.lower()]] = ' '.join(h.values)
 
         if plugin:
-            fmt, fname = plugin(_graphics, headers, body)
-            if fmt in _graphics:
-                body = ('<img src="', fname, '"/>')
-            else:
-                body = (fname, '?')
+            body = self.plugin(plugin, _graphics, headers, body,
+                               partial(self._image, dims))
         else:
-            body = ('<pre>',) + tuple(body) + ('</pre>',)
+            body = ('<pre>', body, '</pre>')
 
         return before + body + after
 
     def text(self, text, emph):
         if text == '\n':
             return ('\n', '  '*(self.__level+2))
+        if '\n' in text:
+            # coalesced text, indent every line break
+            return (text.replace('\n', '\n' + '  '*(self.__level+2)),)
         return (text,)
 
 
 if __name__ == '__main__':
-    from . import stdio as sys
-    import codecs
-    readoc = Document(codecs.getreader('utf-8')(sys.stdin))
-    html = HTML(readoc,
-                title='h1 class="title"',
-                subtitle='h1 class="subtitle"',
-                sectionlevel=1)
-
-    html.dump(codecs.getwriter('utf-8')(sys.stdout))
+    from .cli import main
+    main('html')
@@ -0,0 +1,122 @@
+import os
+import re
+import struct
+from binascii import Error, a2b_base64
+
+# Enough of a file to find the dimensions of most images in
+_HEAD = 1 << 16
+
+_svg_tag = re.compile(br'<svg\b[^>]*>', re.S)
+_svg_attr = re.compile(br'\b(width|height|viewBox)\s*=\s*["\']([^"\']*)["\']')
+_svg_length = re.compile(
+    br'\s*([0-9]*\.?[0-9]+)\s*(px|pt|pc|mm|cm|in)?\s*$')
+# CSS pixels per unit
+_units = {b'px': 1, b'pt': 4 / 3, b'pc': 16, b'mm': 96 / 25.4,
+          b'cm': 96 / 2.54, b'in': 96}
+
+_sizes = {}
+
+
+def _png(head):
+    if head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+
+def _gif(head):
+    return struct.unpack('<HH', head[6:10])
+
+
+def _jpeg(head):
+    # Walk the markers up to the first start of frame
+    pos = 2
+    while pos + 9 <= len(head):
+        if head[pos] != 0xff:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if 0xd0 <= marker <= 0xd9 or marker == 0x01:
+            pos += 2
+            continue
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            h, w = struct.unpack('>HH', head[pos + 5:pos + 9])
+            return w, h
+        pos += 2 + length
+    return None
+
+
+def _svg_px(value):
+    m = _svg_length.match(value)
+    if not m:
+        return None
+    return float(m.group(1)) * _units[m.group(2) or b'px']
+
+
+def _svg(head):
+    tag = _svg_tag.search(head)
+    if not tag:
+        return None
+    attrs = dict(_svg_attr.findall(tag.group(0)))
+    w = _svg_px(attrs.get(b'width', b''))
+    h = _svg_px(attrs.get(b'height', b''))
+    if not (w and h) and b'viewBox' in attrs:
+        box = attrs[b'viewBox'].replace(b',', b' ').split()
+        try:
+            bw, bh = float(box[2]), float(box[3])
+        except (IndexError, ValueError):
+            return None
+        if w and bw:
+            h = w * bh / bw
+        elif h and bh:
+            w = h * bw / bh
+        else:
+            w, h = bw, bh
+    if not (w and h):
+        return None
+    return int(round(w)), int(round(h))
+
+
+def measure(head):
+    # Width and height of the image starting with head, in pixels, or None
+    # if they cannot be told.
+    try:
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return _png(head)
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return _gif(head)
+        if head.startswith(b'\xff\xd8'):
+            return _jpeg(head)
+        if b'<svg' in head:
+            return _svg(head)
+    except (struct.error, ValueError):
+        pass
+    return None
+
+
+def size(src):
+    # measure() for a file or a data: URI. Files are only read again when
+    # they change.
+    if src.startswith('data:'):
+        meta, _, data = src.partition(',')
+        if not meta.endswith(';base64'):
+            return None
+        try:
+            return measure(a2b_base64(data[:_HEAD * 4 // 3 & ~3]))
+        except Error:
+            return None
+
+    try:
+        st = os.stat(src)
+    except OSError:
+        return None
+    stamp = (st.st_size, st.st_mtime_ns)
+    known = _sizes.get(src)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    with open(src, 'rb') as fp:
+        dims = measure(fp.read(_HEAD))
+    _sizes[src] = (stamp, dims)
+    return dims
@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import sys
+
+from . import cli, tags
+from .cache import fingerprint, unchanged
+from .readoc import Document
+from .stdio import Reader, Writer, sniff, stdout
+from .stream import Stream
+
+VERSION = 1
+SUFFIX = '.readoc-index'
+
+
+class _Lines(object):
+    # Hands lines to the document while keeping track of the byte offset
+    # and parser state each line starts at.
+    def __init__(self, reader, offset):
+        self.reader = reader
+        self.encoding = reader.encoding
+        self.next = offset
+        self.offset = None
+        self.state = None
+        self.doc = None
+
+    def readline(self):
+        line = self.reader.readline()
+        self.offset = self.next
+        self.next += len(line.encode(self.encoding))
+        self.state = self.doc.checkpoint()
+        return line
+
+
+class Index(object):
+    def __init__(self, source, encoding, sections):
+        self.source = source
+        self.encoding = encoding
+        self.sections = sections
+
+    @classmethod
+    def build(cls, path):
+        with open(path, 'rb') as fp:
+            encoding, skip = sniff(fp.read(4))
+            fp.seek(0)
+            lines = _Lines(Reader(fp), skip)
+            lines.doc = doc = Document(lines)
+            counter = Stream(None)
+            sections = []
+            for e in doc:
+                if e[0] is not tags.section:
+                    continue
+                level, numbered, title = e[1:]
+                before = list(counter.sections)
+                counter._section(level, numbered, title)
+                number = None
+                if level > 1 or numbered:
+                    number = '.'.join(str(n)
+                                      for n in counter.sections[:level])
+                sections.append({
+                    'number': number,
+                    'level': level,
+                    'numbered': numbered,
+                    'title': title,
+                    'offset': lines.offset,
+                    'sections': before,
+                    'state': lines.state,
+                })
+        return cls(fingerprint(path), encoding, sections)
+
+    @classmethod
+    def load(cls, path, save=True):
+        # The sidecar index is rebuilt whenever the source has changed
+        sidecar = path + SUFFIX
+        try:
+            with open(sidecar) as fp:
+                data = json.load(fp)
+            if data['version'] == VERSION and unchanged(path, data['source']):
+                return cls(data['source'], data['encoding'],
+                           data['sections'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls.build(path)
+        if save:
+            index.save(sidecar)
+        return index
+
+    def save(self, sidecar):
+        tmp = sidecar + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({
+                'version': VERSION,
+                'source': self.source,
+                'encoding': self.encoding,
+                'sections': self.sections,
+            }, fp, indent=1)
+        os.replace(tmp, sidecar)
+
+    def find(self, key):
+        for s in self.sections:
+            if s['number'] == key:
+                return s
+        for s in self.sections:
+            if s['title'] == key:
+                return s
+        raise KeyError(key)
+
+    def events(self, path, section, coalesce=False):
+        # Parse from the section heading up to the next section at the same
+        # level or above.
+        with open(path, 'rb') as fp:
+            fp.seek(section['offset'])
+            doc = Document(Reader(fp, self.encoding), coalesce)
+            doc.restore(section['state'])
+            level = section['level']
+            inside = False
+            for e in doc:
+                if e[0] is tags.section:
+                    if inside and e[1] <= level:
+                        break
+                    inside = True
+                if inside and e[0] is not tags.end:
+                    yield e
+        yield tags.end()
+
+    def render(self, path, key, factory, out, coalesce=True):
+        section = self.find(key)
+        stream = factory(self.events(path, section, coalesce))
+        stream.sections[:] = section['sections']
+        stream.dump(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m readoc.index',
+        description='List the sections of a readoc document, or render '
+        'one of them without parsing the sections before it.')
+    parser.add_argument('-f', '--format', choices=sorted(cli.FORMATS),
+                        default='html')
+    parser.add_argument('input')
+    parser.add_argument('section', nargs='?',
+                        help='section number (e.g. 7.3) or title')
+    args = parser.parse_args(argv)
+
+    index = Index.load(args.input)
+    if args.section is None:
+        for s in index.sections:
+            sys.stdout.write('%s%s %s\n' % (
+                '  ' * (s['level'] - 1), s['number'] or '-', s['title']))
+        return 0
+
+    try:
+        index.find(args.section)
+    except KeyError:
+        sys.stderr.write('No section %s\n' % args.section)
+        return 1
+    with Writer(stdout) as out:
+        index.render(args.input, args.section,
+                     cli.FORMATS[args.format][0], out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,8 @@
 from .stream import Stream
-from .readoc import Document
 from . import plugins
 
 from itertools import chain
+from functools import partial
 
 _sections = {
     1: 'section',
@@ -146,6 +146,13 @@ class Latex(Stream):
             ('\\end{lstlisting}\n')
         )
 
+    def _graphic(self, opts, fmt, fname):
+        if fmt in _graphics:
+            return ('\\centerline{\\includegraphics[',
+                    ', '.join(opts),
+                    ']{', fname, '}}\n')
+        return (fname, '?\n')
+
     def embed(self, lead, body, trail, headers):
         before = ()
         after = ()
@@ -166,19 +173,21 @@ class Latex(Stream):
                 opts.append('scale=' + ' '.join(h.values))
 
         if plugin:
-            fmt, fname = plugin(_graphics, headers, body)
-            if fmt in _graphics:
-                body = ('\\centerline{\\includegraphics[',
-                        ', '.join(opts),
-                        ']{', fname, '}}\n')
-            else:
-                body = (fname, '?\n')
+            body = self.plugin(plugin, _graphics, headers, body,
+                               partial(self._graphic, opts))
         elif verbatim:
-            body = ('\\begin{verbatim}' + ''.join(body) + '\\end{verbatim}',)
+            body = ('\\begin{verbatim}', body, '\\end{verbatim}')
+        else:
+            body = (body,)
 
-        return chain(before, body, after)
+        return tuple(chain(before, body, after))
 
     def text(self, text, emph):
+        if '\n' in text:
+            # coalesced text, one output line per input line
+            return chain.from_iterable(
+                self.text(line, emph) for line in text.split('\n')
+            )
         txt = self._sanitize(text)
         if not txt:
             return ()
@@ -191,9 +200,5 @@ class Latex(Stream):
 
 
 if __name__ == '__main__':
-    from . import stdio as sys
-    import codecs
-    readoc = Document(codecs.getreader('utf-8')(sys.stdin))
-    latex = Latex(readoc, toc=True, def_headers='readoc@')
-
-    latex.dump(codecs.getwriter('utf-8')(sys.stdout))
+    from .cli import main
+    main('latex')
@@ -1,14 +1,130 @@
+import re
 import textwrap
 from math import floor
 
 from .stream import Stream
-from .readoc import Document
 
 from itertools import chain
 from dataclasses import dataclass
 import typing as T
 
 
+# Whitespace TextWrapper turns into plain spaces
+_munge = re.compile('[\t\n\x0b\x0c\r]')
+_wordsep = textwrap.TextWrapper.wordsep_re
+
+
+class _Wrapper(object):
+    # Streaming equivalent of TextWrapper.wrap() with the default options.
+    # Text is fed in as it arrives, completed lines are handed out (aligned)
+    # as soon as it is known they are not the last line of the paragraph.
+    def __init__(self, align):
+        self.align = align
+        self.width = 70
+        self.initial_indent = ''
+        self.subsequent_indent = ''
+
+        self.out = []
+        self.started = False
+        self.wrapped = False
+        self.ws = 0
+        self.line = None
+        self.held = None
+
+    def feed(self, text):
+        # Equivalent to wrapping ' '.join() of everything fed
+        ws = self.ws
+        if self.started:
+            ws += 1
+        self.started = True
+        if _munge.search(text):
+            text = _munge.sub(' ', text)
+
+        first = True
+        for word in text.split(' '):
+            if first:
+                first = False
+            else:
+                ws += 1
+            if not word:
+                continue
+            if ws:
+                self._chunk(' ' * ws)
+                ws = 0
+            if '-' in word:
+                for c in _wordsep.split(word):
+                    if c:
+                        self._chunk(c)
+            else:
+                self._chunk(word)
+        self.ws = ws
+
+        out = self.out
+        if out:
+            self.out = []
+        return out
+
+    def _chunk(self, c):
+        while c:
+            if self.line is None:
+                self.indent = (self.subsequent_indent if self.wrapped
+                               else self.initial_indent)
+                self.room = self.width - len(self.indent)
+                self.line = []
+                self.length = 0
+                if self.wrapped and not c.strip():
+                    return
+
+            n = len(c)
+            if self.length + n <= self.room:
+                self.line.append(c)
+                self.length += n
+                return
+            if n > self.room:
+                c = self._long(c)
+            self._finish()
+
+    def _long(self, c):
+        if self.room < 1:
+            end = 1
+        else:
+            end = self.room - self.length
+        if len(c) > end:
+            hyphen = c.rfind('-', 0, end)
+            if hyphen > 0 and c[:hyphen].strip('-'):
+                end = hyphen + 1
+        self.line.append(c[:end])
+        return c[end:]
+
+    def _finish(self):
+        line = self.line
+        self.line = None
+        if line and not line[-1].strip():
+            del line[-1]
+        if line:
+            if self.held is not None:
+                self.out.append(self.align(
+                    self.held, len(self.initial_indent), self.width) + '\n')
+            self.held = self.indent + ''.join(line)
+            self.wrapped = True
+
+    def close(self):
+        if self.ws:
+            self._chunk(' ' * self.ws)
+        if self.line is not None:
+            self._finish()
+        out = self.out
+        if self.held is not None:
+            out.extend((self.held, '\n'))
+
+        self.out = []
+        self.started = False
+        self.wrapped = False
+        self.ws = 0
+        self.held = None
+        return tuple(out)
+
+
 @dataclass
 class ItemGenerator:
     generator: T.Generator[str, None, None]
@@ -29,20 +145,19 @@ class Normalize(Stream):
     def __init__(self, readoc, justify=False, width=78, section_trail=False):
         super(Normalize, self).__init__(readoc)
 
-        self.__text = []
         self.__lists = []
         self.__level = 0
         self.__width = width
         self.__section_trail = section_trail
-        self.__wrapper = textwrap.TextWrapper()
-        self.__reset()
 
         if justify is True:
-            self.__align = self.__justify
+            align = self.__justify
         elif justify is False:
-            self.__align = self.__packjustify
+            align = self.__packjustify
         else:
-            self.__align = self.__nojustify
+            align = self.__nojustify
+        self.__wrapper = _Wrapper(align)
+        self.__reset()
 
     def __packjustify(self, line, left, right):
         # TODO Be wary of markup containing spaces.
@@ -75,15 +190,7 @@ class Normalize(Stream):
         return line
 
     def __flush(self):
-        if not self.__text:
-            return ()
-        wrapped = self.__wrapper.wrap(' '.join(self.__text))
-        left = len(self.__wrapper.initial_indent)
-        right = self.__width
-        last = wrapped.pop()
-        r = tuple(self.__align(w, left, right) + '\n' for w in wrapped)
-        del self.__text[:]
-        return r + (last, '\n')
+        return self.__wrapper.close()
 
     def __reset(self):
         self.__wrapper.initial_indent = '  '
@@ -161,36 +268,28 @@ class Normalize(Stream):
         self.__wrapper.initial_indent = ind + b
         self.__wrapper.subsequent_indent = itgen.lead
         self.__wrapper.width = self.__width
-        self.__text.append(text)
-        return r
+        return r + tuple(self.__wrapper.feed(text))
 
     def text(self, text, emph):
+        if '\n' in text:
+            # coalesced text, line by line as the wrapper would have seen it
+            return tuple(chain.from_iterable(
+                self.text(line, emph) for line in text.split('\n')))
         text = text.strip()
         if text:
             if emph:
-                self.__text.append('*%s*' % (text,))
-            else:
-                self.__text.append(text)
+                return self.__wrapper.feed('*%s*' % (text,))
+            return self.__wrapper.feed(text)
         return ()
 
     def embed(self, lead, body, trail, headers):
-        return chain(
-            self.__flush(),
-            self._center(lead.strip()),
-            ('\n',),
-            body,
-            self._center(trail.strip()),
-            ('\n',)
-        )
+        return (self.__flush() + self._center(lead.strip()) + ('\n', body) +
+                self._center(trail.strip()) + ('\n',))
 
     def end(self):
         return self.__flush()
 
 
 if __name__ == '__main__':
-    from . import stdio as sys
-    import codecs
-    readoc = Document(codecs.getreader('utf-8')(sys.stdin))
-    normalize = Normalize(readoc, justify=None)
-
-    normalize.dump(codecs.getwriter('utf-8')(sys.stdout))
+    from .cli import main
+    main('normalize')
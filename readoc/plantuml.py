@@ -1,15 +1,141 @@
-from .embed import filename, pipe, accept
+from .embed import filename, pipe, accept, deferring
+from .cache import cache, identity
+from . import profiling
 
 import os
+import shutil
+import subprocess
+import sys
+import threading
+
+_DELIMITER = b'--readoc-plantuml-end--'
+_ERROR = b'ERROR\n'
+
+
+class Server(object):
+    # A long running plantuml in pipe mode, rendering one diagram at a time
+    # and separating the outputs using a delimiter line.
+    def __init__(self, cmd):
+        # errors are reported in front of the diagram on stdout
+        self.cmd = cmd + ['-pipe', '-pipeNoStderr',
+                          '-pipedelimitor', _DELIMITER.decode()]
+        self.lock = threading.Lock()
+        self.sub = None
+        self.broken = False
+        self.buf = b''
+
+    def _start(self):
+        self.sub = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=sys.stderr)
+
+    def _read(self):
+        fd = self.sub.stdout.fileno()
+        while True:
+            i = self.buf.find(_DELIMITER)
+            if i >= 0:
+                e = self.buf.find(b'\n', i)
+                if e >= 0:
+                    data = self.buf[:i]
+                    self.buf = self.buf[e+1:]
+                    return data
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError('plantuml exited')
+            self.buf += chunk
+
+    def render(self, body):
+        with self.lock:
+            if self.broken:
+                return None
+            try:
+                if self.sub is None:
+                    self._start()
+                for part in body:
+                    self.sub.stdin.write(part.encode('utf-8'))
+                self.sub.stdin.write(b'\n')
+                self.sub.stdin.flush()
+                return self._read()
+            except (OSError, EOFError):
+                self.broken = True
+                self._stop()
+                return None
+
+    def _stop(self):
+        if self.sub is None:
+            return
+        try:
+            self.sub.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.sub.wait(5)
+        except subprocess.TimeoutExpired:
+            self.sub.kill()
+            self.sub.wait()
+        self.sub.stdout.close()
+        self.sub = None
+
+    def close(self):
+        with self.lock:
+            self._stop()
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def _single(body):
+    # pipe mode emits one image per diagram, only hand over bodies holding
+    # exactly one complete diagram.
+    start = end = 0
+    for part in body:
+        part = part.lstrip()
+        if part.startswith('@start'):
+            start += 1
+        elif part.startswith('@end'):
+            end += 1
+    return start == 1 and end == 1
+
+
+def _serve(cmd, fname, body):
+    if (os.getenv('PLANTUML_PERSISTENT', '1') == '0' or deferring() or
+            not _single(body)):
+        return False
+    if cache.lookup(fname):
+        return True
+
+    with _servers_lock:
+        server = _servers.get(tuple(cmd))
+        if server is None:
+            server = _servers[tuple(cmd)] = Server(cmd)
+
+    data = server.render(body)
+    if data is None or data.startswith(_ERROR):
+        # left to the per diagram command, which reports the error and
+        # keeps nothing
+        return False
+    profiling.note(status=0, worker=True)
+    tmp = cache.temporary(fname)
+    with open(tmp, 'wb') as fp:
+        fp.write(data)
+    cache.commit(tmp, fname)
+    return True
+
+
+def close():
+    with _servers_lock:
+        servers = list(_servers.values())
+        _servers.clear()
+    for server in servers:
+        server.close()
 
 
 def _plantuml(fmt, headers, body):
-    fname = filename('plantuml', fmt, body)
     JAVA_HOME = os.getenv('JAVA_HOME')
     if JAVA_HOME:
         JAVA = JAVA_HOME + '/bin/java'
     else:
-        JAVA = '/usr/bin/java'
+        JAVA = shutil.which('java') or '/usr/bin/java'
 
     cmd = [JAVA]
 
@@ -22,8 +148,11 @@ def _plantuml(fmt, headers, body):
     if RELATIVE_INCLUDE:
         cmd.append('-DRELATIVE_INCLUDE=' + RELATIVE_INCLUDE)
 
-    cmd.extend(['-jar', JAR, '-T' + fmt, '-p'])
-    pipe(cmd, fname, body)
+    cmd.extend(['-jar', JAR, '-charset', 'UTF-8', '-T' + fmt])
+    fname = filename('plantuml', fmt, body, headers,
+                     cmd + [identity(JAVA), identity(JAR)])
+    if not _serve(cmd, fname, body):
+        pipe(cmd + ['-p'], fname, body)
     return fmt, fname
 
 
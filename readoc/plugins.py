@@ -1,30 +1,77 @@
-from . import graphviz, plantuml, b64embed, fileembed
+from . import graphviz, plantuml, b64embed, fileembed, profiling
+from .cache import cache
 
+import atexit
+from contextlib import contextmanager
 from itertools import chain
 
+_MODULES = (graphviz, plantuml, b64embed, fileembed)
+
 EMBED = dict(
-    chain.from_iterable(m.EMBED.items() for m in
-                        (graphviz, plantuml, b64embed, fileembed))
+    chain.from_iterable(m.EMBED.items() for m in _MODULES)
+)
+
+# Plugins giving the content itself (e.g. as a data: URI) rather than a file
+INLINE = dict(
+    chain.from_iterable(getattr(m, 'INLINE', {}).items() for m in _MODULES)
 )
 
 
 class Plugged(object):
-    def __init__(self, embed):
+    def __init__(self, embed, name=None):
         self.embed = embed
+        self.name = name
 
     def __call__(self, fmts, headers, body):
-        return self.embed(fmts, headers, body)
+        profile = profiling.active
+        if profile is not None:
+            fmt, fname = profile.plugin(self.name, self.embed,
+                                        fmts, headers, body)
+        else:
+            fmt, fname = self.embed(fmts, headers, body)
+        if _recording is not None and not fname.startswith('data:'):
+            _recording.add(fname)
+        return fmt, fname
+
+
+_recording = None
+
+
+@contextmanager
+def record():
+    # Collects the files produced or referenced by plugins while active.
+    global _recording
+    prev = _recording
+    _recording = files = set()
+    try:
+        yield files
+    finally:
+        _recording = prev
 
 
 def rchop(s, sub):
     return s[:-len(sub)] if sub and s.endswith(sub) else s
 
 
-def embed(headers):
+def embed(headers, inline=False):
     for h in headers:
         if h.key in ('\\_', '|'):
             trailer = {'\\_': ':_/', '|': ':|'}
-            plugin = EMBED.get(rchop(h.values[0], trailer.get(h.key)))
+            name = rchop(h.values[0], trailer.get(h.key))
+            plugin = (inline and INLINE.get(name)) or EMBED.get(name)
             if not plugin:
                 return None
-            return Plugged(plugin)
+            return Plugged(plugin, name)
+
+
+def close():
+    # Shut down any long running helpers (e.g. plantuml workers) the plugins
+    # have started, and write back the render cache index.
+    for m in _MODULES:
+        fn = getattr(m, 'close', None)
+        if fn:
+            fn()
+    cache.flush()
+
+
+atexit.register(close)
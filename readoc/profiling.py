@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+
+# The profile plugin invocations are reported to, if any
+active = None
+
+_local = threading.local()
+
+
+class Profile(object):
+    def __init__(self):
+        self.events = {}
+        self.handlers = {}
+        self.plugins = []
+        self.wall = 0.0
+
+    def _add(self, table, key, elapsed):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def cord(self, cord):
+        # Time spent producing each event (i.e. parsing), by tag
+        clock = time.perf_counter
+        it = iter(cord)
+        while True:
+            start = clock()
+            try:
+                e = next(it)
+            except StopIteration:
+                return
+            self._add(self.events, repr(e[0]), clock() - start)
+            yield e
+
+    def handler(self, name, fn):
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            try:
+                return fn(*args)
+            finally:
+                self._add(self.handlers, name, clock() - start)
+        return timed
+
+    def plugin(self, name, fn, *args):
+        record = {'plugin': name, 'status': None, 'cache': None}
+        prev = getattr(_local, 'record', None)
+        _local.record = record
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+            output = result[1]
+            if output.startswith('data:'):
+                # inlined content, only say what it was
+                output = output.partition(',')[0]
+            record['output'] = output
+            return result
+        except Exception as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            _local.record = prev
+            self.plugins.append(record)
+
+    def report(self):
+        table = (lambda t: {k: {'count': c, 'seconds': s}
+                            for k, (c, s) in sorted(t.items())})
+        return {
+            'wall': self.wall,
+            'events': table(self.events),
+            'handlers': table(self.handlers),
+            'plugins': self.plugins,
+        }
+
+    def dump(self, fp):
+        json.dump(self.report(), fp, indent=1)
+        fp.write('\n')
+
+
+def note(**kw):
+    # Called by the embed helpers to annotate the running plugin invocation
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.update(kw)
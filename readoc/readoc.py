@@ -1,16 +1,58 @@
+import os
 import re
+import struct
+import tempfile
+import weakref
 from collections import deque
+from operator import itemgetter
 
 from . import tags
 
-_header_match = re.compile(r'([^\s:]+): *((?:\S+\s)*\S+)|'
-                           r'((?:\S+\s)*\S+)')
-_embed_match = re.compile(r'\s*(-\s*)')
-# '([^\s:]+(?:\s(?:\S+\s)*\S+)?)')
-_emph_split = re.compile(r'(\b(\*|_)\2*\b|(\*|_)\3*\b|\b(\*|_)\4*)')
+# Values are words separated by single white space characters, written so
+# that a failed match never backtracks into the words.
+_header_match = re.compile(r'([^\s:]+): *(\S+(?:\s\S+)*)|'
+                           r'(\S+(?:\s\S+)*)')
+_emph_runs = re.compile(r'\*+|_+')
+
+# Line classification, see _classify()
+_MARKER, _SECTION = range(2)
+_marker = re.compile(r'[-\s]+')
+_item = re.compile(r'([0-9]+|\w)\.\s*|([-+*])\s+')
+_heading = re.compile(r'([0-9]+(?:\.[0-9]+)*)\.?\s*')
+# Length of a line stored by a spilled Body
+_LENGTH = struct.Struct('<I')
+
+
+def _classify(line):
+    # Takes a right stripped, non-empty line and returns its indentation,
+    # the line without it, and what it looks like: an embed marker (with its
+    # dash count), a list item (tags.ordered or tags.unordered, with the
+    # label and the offset of the item text), a section heading (with the
+    # section number and the offset of the title) or None.
+    text = line.lstrip()
+    i = len(line) - len(text)
+    c = text[0]
+    if c == '-':
+        n = text.count('-')
+        if n > 3 and _marker.fullmatch(text):
+            return i, text, _MARKER, n, 0
+    if i:
+        m = _item.match(text)
+        if m:
+            lbl = m.group(1)
+            if lbl is None:
+                return i, text, tags.unordered, m.group(2), m.end()
+            if '0' <= lbl[0] <= '9' or lbl.isalpha():
+                return i, text, tags.ordered, lbl, m.end()
+    elif '0' <= c <= '9':
+        m = _heading.match(text)
+        return i, text, _SECTION, m.group(1), m.end()
+    return i, text, None, None, 0
 
 
 class Header(object):
+    __slots__ = ('key', 'values', 'left', 'right')
+
     def __init__(self, key, left, right):
         self.key = key
         self.values = []
@@ -38,6 +80,28 @@ class Header(object):
 class Headers(object):
     def __init__(self):
         self.list = []
+        # The index of the most recent header covering each column, so that
+        # continuations find the header they overlap without a search. Only
+        # built once a continuation does not overlap the latest header.
+        self.owner = None
+
+    def _cover(self, i, left, right):
+        owner = self.owner
+        if len(owner) < right:
+            owner.extend([-1] * (right - len(owner)))
+        owner[left:right] = [i] * (right - left)
+
+    def _find(self, left, right):
+        # the most recent header overlapping columns left to right
+        if self.list:
+            h = self.list[-1]
+            if h.left < right and left < h.right:
+                return len(self.list) - 1
+        if self.owner is None:
+            self.owner = []
+            for i, h in enumerate(self.list):
+                self._cover(i, h.left, h.right)
+        return max(self.owner[left:right], default=-1)
 
     def read(self, line):
         hit = False
@@ -48,81 +112,145 @@ class Headers(object):
                 h = Header(m.group(1), m.start(1), m.end(2))
                 h.add(m.group(2))
                 self.list.append(h)
+                if self.owner is not None:
+                    self._cover(len(self.list) - 1, h.left, h.right)
             else:
                 # continuation
-                for h in reversed(self.list):
-                    if(h.fit(m.start(3), m.end(3))):
-                        h.add(m.group(3))
-                        break
-                else:
+                left, right = m.span(3)
+                i = self._find(left, right)
+                if i < 0:
                     # no match
                     return False
+                h = self.list[i]
+                if left < h.left and self.owner is not None:
+                    # columns now covered by h, unless by a later header
+                    owner = self.owner
+                    for c in range(left, h.left):
+                        if owner[c] < i:
+                            owner[c] = i
+                h.fit(left, right)
+                h.add(m.group(3))
         if not hit:
             # empty line
             return False
         return True
 
 
+class Body(object):
+    # The lines of an embed. Past `limit` characters they are moved to a
+    # temporary file, so that a large embed is never held in memory as a
+    # whole. Can be iterated over any number of times, from any thread, each
+    # iteration reading the file through a handle of its own.
+    limit = 1 << 20
+
+    def __init__(self):
+        self.lines = []
+        self.size = 0
+        self.path = None
+        self.file = None
+        # stripped from every line as they are iterated over, see dedent()
+        self.indent = 0
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def _store(self, line):
+        # Lines are stored with their length in front, so they come back
+        # exactly as they were appended
+        data = line.encode('utf-8')
+        self.file.write(_LENGTH.pack(len(data)))
+        self.file.write(data)
+
+    def append(self, line):
+        if self.file is not None:
+            self._store(line)
+            return
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size > self.limit:
+            fd, self.path = tempfile.mkstemp(prefix='readoc-')
+            weakref.finalize(self, _unlink, self.path)
+            self.file = os.fdopen(fd, 'wb')
+            for line in self.lines:
+                self._store(line)
+            self.lines = []
+
+    def close(self):
+        # Done appending
+        if self.file is not None:
+            self.file.close()
+
+    def _read(self, block=1 << 16):
+        if not self.file.closed:
+            self.file.flush()
+        with open(self.path, 'rb') as fp:
+            buf = bytearray()
+            for data in iter(lambda: fp.read(block), b''):
+                buf += data
+                pos = 0
+                while len(buf) - pos >= _LENGTH.size:
+                    n, = _LENGTH.unpack_from(buf, pos)
+                    end = pos + _LENGTH.size + n
+                    if end > len(buf):
+                        break
+                    yield buf[pos + _LENGTH.size:end].decode('utf-8')
+                    pos = end
+                del buf[:pos]
+
+    def __iter__(self):
+        lines = iter(self.lines) if self.path is None else self._read()
+        if not self.indent:
+            return lines
+        return map(itemgetter(slice(self.indent, None)), lines)
+
+    def dedent(self):
+        # Strip the indentation common to all lines that are not blank
+        indent = 512
+        for line in self:
+            text = line.lstrip()
+            if text:
+                indent = min(indent, len(line) - len(text))
+        self.indent += indent
+
+    def __repr__(self):
+        return 'Body(%r)' % (list(self),)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
 class Embeded(object):
     def __init__(self):
         self.state = 0
 
     def check(self, line):
-        s = 0
-        e = len(line)
-        c = 0
-        while s < e:
-            m = _embed_match.match(line, s)
-            if not m:
-                return False
-            c += 1
-            s = m.end()
-
-        return c
-
-    def start(self, line):
-        em = self.check(line)
-        if em > 3:
-            self.state = 1
-            self.body = []
-            self.marker = em
-            self.lead = line
-            self.trail = None
-            self.headers = Headers()
-            return True
-
+        if '-' in line and _marker.fullmatch(line):
+            return line.count('-')
         return False
 
-    def __dedent(self):
-        body = self.body
-        indent = 512
-        for line in body:
-            if not line:
-                continue
-            search = 0
-            for c in line:
-                if c.isspace():
-                    search += 1
-                else:
-                    break
-            else:
-                continue
-            indent = min(indent, search)
-        if indent > 0:
-            for i, line in enumerate(body):
-                if not line:
-                    continue
-                body[i] = line[indent:]
+    def start(self, line, marker):
+        self.state = 1
+        self.body = Body()
+        self.marker = marker
+        self.lead = line
+        self.trail = None
+        self.headers = Headers()
 
     def end(self):
         self.state = 0
+        self.body.close()
         for h in self.headers.list:
             if h.key == '!':
                 for v in h.values:
                     if v == 'discard':
                         return None
                     if v == 'dedent':
-                        self.__dedent()
+                        self.body.dedent()
         return tags.embed(self.lead, self.body, self.trail,
                           self.headers.list)
 
@@ -147,7 +275,7 @@ class Document(object):
      LIMBO,
      PARA) = range(4)
 
-    def __init__(self, fp):
+    def __init__(self, fp, coalesce=False):
         self.fp = fp
         self.indent = []
         self.state = Document.HEAD
@@ -155,12 +283,58 @@ class Document(object):
         self.headers = Headers()
         self.embeded = Embeded()
 
+        # When coalescing, line breaks are merged with the plain text runs
+        # around them into a single text event, keeping the breaks as '\n'
+        # within the text. Runs within a line are left as they are.
+        self.coalesce = coalesce
+        self._run = None
+
         self._queue = deque()
         self._end = False
 
     def q(self, item):
+        if self._run:
+            self._flush_text()
         self._queue.append(item)
 
+    def _flush_text(self):
+        parts, emph = self._run
+        self._run = None
+        self._queue.append(tags.text(''.join(parts), emph))
+
+    def _q_text(self, txt, emph):
+        if not self.coalesce:
+            self.q(tags.text(txt, emph))
+        elif txt:
+            run = self._run
+            if run and run[1] == emph and (
+                    txt == '\n' or run[0][-1].endswith('\n')):
+                run[0].append(txt)
+            else:
+                if run:
+                    self._flush_text()
+                self._run = ([txt], emph)
+
+    def checkpoint(self):
+        # Parser state between two lines, plain data so it can be stored.
+        # Pending embeds and document headers are not part of it.
+        return {
+            'state': self.state,
+            'indent': [[i, tag.name, co] for i, tag, co in self.indent],
+            'separated': self.separated,
+        }
+
+    def restore(self, checkpoint):
+        self.state = checkpoint['state']
+        self.indent = [(i, getattr(tags, name), co)
+                       for i, name, co in checkpoint['indent']]
+        self.separated = checkpoint['separated']
+        self.headers = Headers()
+        self.embeded = Embeded()
+        self._run = None
+        self._queue.clear()
+        self._end = False
+
     def pop(self):
         while not self._queue:
             if self._end:
@@ -174,6 +348,17 @@ class Document(object):
 
         return self._queue.popleft()
 
+    def feed(self, line):
+        # The push alternative to iterating: hand over the next line, or ''
+        # at the end of the input, and get back the events it completed.
+        if not line:
+            self._end = True
+            self.end()
+        self.line(line)
+        events = list(self._queue)
+        self._queue.clear()
+        return events
+
     def __iter__(self):
         return self
 
@@ -204,24 +389,36 @@ class Document(object):
         self.q(tags.end())
 
     def _text(self, line):
-        es = _emph_split.split(line)
-        i = iter(es)
+        # A run of '*' opens emphasis when followed by a word character and
+        # closes it when only preceded by one. A run of '_', being a word
+        # character itself, opens when not followed by one and closes when
+        # only not preceded by one. Otherwise the run is plain text. The
+        # length of the run is the emphasis bit mask.
+        q_text = self._q_text
         emph = 0
-        try:
-            while True:
-                txt = next(i)
-                self.q(tags.text(txt, emph))
-                run, both, lead, trail = next(i), next(i), next(i), next(i)
-                lead = lead or both
-                trail = trail or both
-                count = len(run)
-                if lead:
-                    emph |= count
-                elif trail:
-                    emph &= ~count
-        except StopIteration:
-            pass
-        self.q(tags.text('\n', 0))
+        if '*' in line or '_' in line:
+            s = 0
+            n = len(line)
+            for m in _emph_runs.finditer(line):
+                b, e = m.span()
+                before = line[b-1] if b else ''
+                after = line[e] if e < n else ''
+                wb = before.isalnum() or before == '_'
+                wa = after.isalnum() or after == '_'
+                if line[b] == '*':
+                    lead, trail = wa, wb
+                else:
+                    lead, trail = not wa, not wb
+                if lead or trail:
+                    q_text(line[s:b], emph)
+                    if lead:
+                        emph |= e - b
+                    else:
+                        emph &= ~(e - b)
+                    s = e
+            line = line[s:]
+        q_text(line, emph)
+        q_text('\n', 0)
 
     def line(self, line):
         if self.embeded.state:
@@ -252,16 +449,14 @@ class Document(object):
             self.q(tags.headers(self.headers.list))
             self.state = Document.TITLE
 
-        if self.embeded.start(line):
+        i, text, kind, lbl, o = _classify(line)
+
+        if kind == _MARKER:
+            self.embeded.start(line, lbl)
             if separated:
                 self._clean_para()
             return
-
-        i = len(line)
-        line = line.lstrip()
-        i -= len(line)
-
-        o = 0
+        line = text
 
         if self.state <= Document.TITLE:
             if i > 5:
@@ -270,14 +465,7 @@ class Document(object):
                 return
 
         if i > 0:
-            tag = None
-            lbl, o = self.ordered(line)
-            if lbl:
-                tag = tags.ordered
-            else:
-                lbl, o = self.unordered(line)
-                if lbl:
-                    tag = tags.unordered
+            tag = kind
 
             while self.indent:
                 xi, xt, xco = self.indent[-1]
@@ -321,30 +509,13 @@ class Document(object):
         if self.state < Document.LIMBO:
             self.state = Document.LIMBO
 
-        if i == 0 and line:
-            level = 0
-            numbered = True
-            while True:
-                num, o = self.num(line, o)
-                if num is None:
-                    break
-                if not (level or int(num)):
-                    numbered = False
-
-                level += 1
-
-                if line[o] == '.':
-                    o += 1
-                elif line[o].isspace():
-                    break
-
-            if level:
-                o = self._skip(line, o)
-                if self.state == Document.PARA:
-                    self.q(tags.para(False))
-                    self.state = Document.LIMBO
-                self.q(tags.section(level, numbered, line[o:]))
-                return
+        if kind == _SECTION:
+            if self.state == Document.PARA:
+                self.q(tags.para(False))
+                self.state = Document.LIMBO
+            numbered = int(lbl.partition('.')[0]) != 0
+            self.q(tags.section(lbl.count('.') + 1, numbered, line[o:]))
+            return
 
         if separated and self.state == Document.PARA:
             self.q(tags.para(False))
@@ -355,48 +526,3 @@ class Document(object):
             self.q(tags.para(True))
 
         self._text(line)
-
-    def num(self, line, o):
-        b = o
-        while '0' <= line[o] <= '9':
-            o += 1
-
-        return (line[b:o] if o > b else None, o)
-
-    def _skip(self, line, o):
-        for x in line[o:]:
-            if not x.isspace():
-                break
-            o += 1
-        return o
-
-    def _check_set(self, line, o, args):
-        c = 0
-        for x in line[o+1:]:
-            if x in args:
-                c += 1
-            else:
-                break
-        return c
-
-    def ordered(self, line, o=0):
-        for roman in ('ivx', 'IVX'):
-            c = self._check_set(line, o, roman)
-            if c and line[o+c] == '.':
-                return line[o:o+c], self._skip(line, o+c+1)
-
-        if line[o].isalpha() and line[o+1] == '.':
-            return line[o], self._skip(line, o+2)
-
-        n, o = self.num(line, o)
-        if n is not None and line[o] == '.':
-            return n, self._skip(line, o+1)
-
-        return None, o
-
-    def unordered(self, line, o=0):
-        if len(line) < o+2:
-            return None, o
-        if line[o] in ('-', '+', '*') and line[o+1].isspace():
-            return line[o], self._skip(line, o+2)
-        return None, o
@@ -0,0 +1,151 @@
+import marshal
+
+from . import tags
+from .cache import cache, digest, sources
+from .readoc import Body, Document, Header
+from .stdio import Reader
+
+MAGIC = b'readoc-events 2\n'
+
+# Replayed events depend on the parser as much as on the input
+_CODE = ('readoc.py', 'tags.py', 'stdio.py', 'serial.py')
+
+
+# The cache may be shared, so events are stored as plain data (marshal of
+# tuples, lists, strings and numbers) and the tags, headers and bodies are
+# built again when loading.
+def _headers(headers, intern):
+    return [(intern(h.key), [intern(v) for v in h.values], h.left, h.right)
+            for h in headers]
+
+
+def _encode(e, intern):
+    tag = e[0]
+    if tag is tags.headers:
+        return (tag.name, _headers(e[1], intern))
+    if tag is tags.embed:
+        lead, body, trail, headers = e[1:]
+        return (tag.name, intern(lead), [intern(b) for b in body],
+                trail if trail is None else intern(trail),
+                _headers(headers, intern))
+    return (tag.name,) + tuple(intern(a) if type(a) is str else a
+                               for a in e[1:])
+
+
+def _header(key, values, left, right):
+    h = Header(key, left, right)
+    h.values = list(values)
+    return h
+
+
+def _body(lines):
+    body = Body()
+    body.lines = list(lines)
+    return body
+
+
+def _decode(e):
+    tag = tags.TAGS[e[0]]
+    if tag is tags.headers:
+        return (tag, [_header(*h) for h in e[1]])
+    return (tag, e[1], _body(e[2]), e[3], [_header(*h) for h in e[4]])
+
+
+class _Dumper(object):
+    # Writes events as a series of marshalled chunks, so that replay never
+    # holds more than a chunk of them. Within a chunk, equal strings are
+    # written once, marshal refers back to repeated objects.
+    def __init__(self, fp, chunk=1 << 12):
+        self.fp = fp
+        self.chunk = chunk
+        self.pending = []
+        self.strings = {}
+        fp.write(MAGIC)
+
+    def _intern(self, s):
+        return self.strings.setdefault(s, s)
+
+    def add(self, e):
+        self.pending.append(_encode(e, self._intern))
+        if len(self.pending) == self.chunk:
+            self._flush()
+
+    def _flush(self):
+        marshal.dump(self.pending, self.fp)
+        self.pending = []
+        self.strings.clear()
+
+    def close(self):
+        if self.pending:
+            self._flush()
+        marshal.dump(None, self.fp)
+
+
+def dump(events, fp, chunk=1 << 12):
+    dumper = _Dumper(fp, chunk)
+    for e in events:
+        dumper.add(e)
+    dumper.close()
+
+
+def load(fp):
+    # The events written by dump(), read a chunk at a time
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a readoc event file')
+    special = (tags.headers.name, tags.embed.name)
+    while True:
+        chunk = marshal.load(fp)
+        if chunk is None:
+            return
+        try:
+            events = [(tags.TAGS[e[0]],) + e[1:] if e[0] not in special
+                      else _decode(e) for e in chunk]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError('corrupt readoc event file')
+        yield from events
+
+
+def _replay(path):
+    with open(path, 'rb') as fp:
+        yield from load(fp)
+
+
+def _record(events, path):
+    # Passes the events on while writing them to the cache. Documents with
+    # embeds too large to keep in memory are not cached.
+    tmp = cache.temporary(path)
+    try:
+        with open(tmp, 'wb') as fp:
+            dumper = _Dumper(fp)
+            for e in events:
+                if dumper is not None:
+                    if e[0] is tags.embed and e[2].spilled:
+                        dumper = None
+                    else:
+                        dumper.add(e)
+                yield e
+            if dumper is not None:
+                dumper.close()
+    except BaseException:
+        cache.discard(tmp)
+        raise
+    if dumper is None:
+        cache.discard(tmp)
+    else:
+        cache.commit(tmp, path)
+
+
+def parse(fp, coalesce=False):
+    # The events of the document read from the binary stream fp, replayed
+    # from the cache when the same input has been parsed before. Only used
+    # with a configured cache directory, and inputs that can be read twice.
+    if not cache.directory or not fp.seekable():
+        return Document(Reader(fp), coalesce)
+    start = fp.tell()
+    content = digest(fp)
+    fp.seek(start)
+    path = cache.path('events', 'bin', (), tool=(
+        content, str(bool(coalesce)), sources(*_CODE)))
+    if cache.lookup(path):
+        return _replay(path)
+    return _record(Document(Reader(fp), coalesce), path)
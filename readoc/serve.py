@@ -0,0 +1,251 @@
+import argparse
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from html import escape
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+from . import cli, serial
+from .cache import cache, digest, sources
+
+SOURCE = '.txt'
+
+# Pages change with these as much as with their source
+_CODE = ('readoc.py', 'stream.py', 'html.py', 'cli.py', 'plugins.py',
+         'images.py', 'b64embed.py')
+
+# Image files shown in a page, whose sizes the page is rendered with
+_IMAGE = re.compile(br'<img src="(?!data:)([^"]+)"')
+
+# Plugin outputs (see cache.Cache.path) are named by their content, so
+# never change
+_RENDERED = re.compile(r'[\w.+-]+-[0-9a-f]{32}\.\w+')
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Pages(object):
+    # Rendered pages, least recently used first, keyed on the source digest
+    # and the renderer (a cli format, which fixes the renderer options).
+    def __init__(self, size=128, fmt='html'):
+        self.size = size
+        self.fmt = fmt
+        self.code = sources(*_CODE)
+        self.pages = OrderedDict()
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def _digest(self, path):
+        # Sources are only hashed again when their size or mtime changes
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        known = self.digests.get(path)
+        if known and known[0] == stamp:
+            return known[1], None
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        value = digest(io.BytesIO(data))
+        self.digests[path] = (stamp, value)
+        return value, data
+
+    def _etag(self, digest, stamps):
+        return '"%s"' % hashlib.sha1(('%s %s %s %r' % (
+            digest, self.fmt, self.code, stamps)).encode('utf-8')).hexdigest()
+
+    def get(self, path, match=None):
+        # Returns the ETag and the page, or no page if `match` (a
+        # If-None-Match header) matches the ETag. Which images a page
+        # shows is only known once it has been rendered.
+        digest, data = self._digest(path)
+        key = (digest, self.fmt)
+        with self.lock:
+            known = self.pages.get(key)
+            if known is not None:
+                self.pages.move_to_end(key)
+        if known is not None:
+            page, srcs, stamps = known
+            if _stamps(srcs) == stamps:
+                etag = self._etag(digest, stamps)
+                if _matches(match, etag):
+                    return etag, None
+                return etag, page
+
+        if data is None:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        out = io.StringIO()
+        readoc = serial.parse(io.BytesIO(data), coalesce=True)
+        cli.FORMATS[self.fmt][0](readoc).dump(out)
+        page = out.getvalue().encode('utf-8')
+        srcs = tuple(sorted(set(
+            os.fsdecode(src) for src in _IMAGE.findall(page))))
+        stamps = _stamps(srcs)
+
+        with self.lock:
+            self.pages[key] = (page, srcs, stamps)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+        etag = self._etag(digest, stamps)
+        if _matches(match, etag):
+            return etag, None
+        return etag, page
+
+
+def _stamps(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def _matches(header, etag):
+    if header is None:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'readoc'
+    root = '.'
+    pages = None
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def _serve(self, body):
+        path = unquote(urlsplit(self.path).path)
+        local = self._local(path)
+        if local is None:
+            return self.send_error(HTTPStatus.NOT_FOUND)
+
+        if os.path.isdir(local):
+            if not path.endswith('/'):
+                return self._redirect(path + '/')
+            return self._listing(local, body)
+
+        source = os.path.splitext(local)[0] + SOURCE
+        if local.endswith('.html') and os.path.isfile(source):
+            return self._page(source, body)
+
+        # Images and other files produced by the plugins
+        name = os.path.basename(local)
+        rendered = os.path.join(cache.directory, name)
+        if _RENDERED.fullmatch(name) and os.path.isfile(rendered):
+            return self._file(rendered, body, _IMMUTABLE)
+        if os.path.isfile(local):
+            return self._file(local, body, 'no-cache')
+        self.send_error(HTTPStatus.NOT_FOUND)
+
+    def _local(self, path):
+        root = os.path.realpath(self.root)
+        local = os.path.realpath(os.path.join(root, path.lstrip('/')))
+        if local != root and not local.startswith(root + os.sep):
+            return None
+        return local
+
+    def _redirect(self, location):
+        self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+        self.send_header('Location', quote(location))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _page(self, source, body):
+        try:
+            etag, data = self.pages.get(source,
+                                        self.headers.get('If-None-Match'))
+        except Exception:
+            traceback.print_exc()
+            return self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+        self._send(data, 'text/html; charset=utf-8', etag, 'no-cache', body)
+
+    def _file(self, path, body, cache_control):
+        st = os.stat(path)
+        etag = '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+        ctype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if _matches(self.headers.get('If-None-Match'), etag):
+            return self._send(None, ctype, etag, cache_control, body)
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        self._send(data, ctype, etag, cache_control, body)
+
+    def _listing(self, local, body):
+        names = sorted(n for n in os.listdir(local)
+                       if n.endswith(SOURCE) or
+                       os.path.isdir(os.path.join(local, n)))
+        items = []
+        for n in names:
+            if n.endswith(SOURCE):
+                n = n[:-len(SOURCE)] + '.html'
+            else:
+                n += '/'
+            items.append('<li><a href="%s">%s</a></li>\n' % (
+                quote(n), escape(n)))
+        data = ('<ul>\n%s</ul>\n' % ''.join(items)).encode('utf-8')
+        self._send(data, 'text/html; charset=utf-8', None, 'no-cache', body)
+
+    def _send(self, data, ctype, etag, cache_control, body):
+        if etag and data is not None and _matches(
+                self.headers.get('If-None-Match'), etag):
+            data = None
+        self.send_response(HTTPStatus.OK if data is not None
+                           else HTTPStatus.NOT_MODIFIED)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        if data is not None:
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body and data is not None:
+            self.wfile.write(data)
+
+
+def server(root='.', host='127.0.0.1', port=8000, size=128):
+    handler = type('Handler', (Handler,), {
+        'root': root,
+        'pages': Pages(size),
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m readoc.serve',
+        description='Serve the readoc documents (*.txt) in a directory as '
+        'HTML, rendered on request.')
+    parser.add_argument('root', nargs='?', default='.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('--pages', type=int, default=128,
+                        help='number of rendered pages kept in memory')
+    args = parser.parse_args(argv)
+
+    httpd = server(args.root, args.host, args.port, args.pages)
+    sys.stderr.write('Serving %s on http://%s:%d/\n' % (
+        args.root, args.host, httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,9 @@
+import codecs
+import mmap
+import os
+import stat
 import sys
+from collections import deque
 
 
 def _compat(stream):
@@ -8,3 +13,146 @@ def _compat(stream):
 
 stdin = _compat(sys.stdin)
 stdout = _compat(sys.stdout)
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+# Characters str.splitlines() breaks on
+_BREAKS = u'\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def sniff(head):
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    return 'utf-8', 0
+
+
+class Decoder(object):
+    # Decodes bytes handed over in blocks into lines, split as
+    # str.splitlines(True) would split the whole text.
+    def __init__(self, encoding):
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.lines = deque()
+        self.tail = u''
+
+    def decode(self, data, final):
+        text = self.tail + self.decoder.decode(data, final)
+        lines = text.splitlines(True)
+        self.tail = u''
+        if lines and not final:
+            # keep an unterminated line, or a '\r' which may be followed by
+            # '\n' in the next block, for later
+            last = lines[-1][-1]
+            if last == u'\r' or last not in _BREAKS:
+                self.tail = lines.pop()
+        self.lines.extend(lines)
+
+
+class Reader(object):
+    # Decodes a binary stream in large blocks, picking the encoding from the
+    # byte order mark (UTF-8 if there is none), and hands out lines through
+    # readline(). Regular files are memory mapped rather than read.
+    def __init__(self, raw, encoding=None, block=1 << 20):
+        self.block = block
+        self.map = None
+        self.pos = 0
+        self.eof = False
+
+        try:
+            st = os.fstat(raw.fileno())
+            if stat.S_ISREG(st.st_mode) and st.st_size > raw.tell():
+                self.pos = raw.tell()
+                self.map = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            pass
+        if self.map is None:
+            self.raw = getattr(raw, 'read1', raw.read)
+
+        head = self._read()
+        while 0 < len(head) < 3:
+            more = self._read()
+            if not more:
+                break
+            head += more
+
+        skip = 0
+        if encoding is None:
+            encoding, skip = sniff(head)
+        self.encoding = encoding
+        self.decoder = Decoder(encoding)
+        self.lines = self.decoder.lines
+        self._decode(head[skip:], not head)
+
+    def _read(self):
+        if self.eof:
+            return b''
+        if self.map is None:
+            return self.raw(self.block)
+        data = self.map[self.pos:self.pos + self.block]
+        self.pos += len(data)
+        return data
+
+    def _decode(self, data, final):
+        self.decoder.decode(data, final)
+        if final:
+            self.close()
+
+    def readline(self):
+        while not self.lines:
+            if self.eof:
+                return u''
+            data = self._read()
+            self._decode(data, not data)
+        return self.lines.popleft()
+
+    def __iter__(self):
+        return iter(self.readline, u'')
+
+    def close(self):
+        self.eof = True
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class Writer(object):
+    # Collects text fragments and writes them to a binary stream encoded in
+    # large chunks. Flushed when holding more than `size` characters, at
+    # section boundaries if `sections` is set, and when closed.
+    def __init__(self, raw, encoding='utf-8', size=1 << 16, sections=False):
+        self.raw = raw
+        self.encoding = encoding
+        self.size = size
+        self.sections = sections
+        self.parts = []
+        self.pending = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.size is not None and self.pending >= self.size:
+            self.flush()
+
+    def boundary(self):
+        if self.sections:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.raw.write(u''.join(self.parts).encode(self.encoding))
+            self.parts = []
+            self.pending = 0
+        self.raw.flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,6 +1,81 @@
+import asyncio
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from . import tags
+from . import embed, tags, profiling
+from .readoc import Body
+
+
+class _Pending(object):
+    def __init__(self, future, render):
+        self.future = future
+        self.render = render
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return u''.join(self.render(*self.future.result()))
+
+
+def _chunks(text):
+    run = []
+    for t in text:
+        if isinstance(t, (_Pending, Body)):
+            if run:
+                yield u''.join(run)
+                run = []
+            if isinstance(t, Body):
+                yield from t
+            else:
+                yield t
+        else:
+            run.append(t)
+    if run:
+        yield u''.join(run)
+
+
+def _write(write, text):
+    # The text of an embed may hold its body, which is written a line at a
+    # time so that a spilled body is never held as a whole.
+    for t in text:
+        if isinstance(t, Body):
+            for line in t:
+                write(line)
+        else:
+            write(t)
+
+
+class _Ordered(object):
+    # Output queue for text with pending plugin results in it, writing
+    # everything up to the first unfinished one.
+    def __init__(self, out):
+        self.out = out
+        self.queue = deque()
+
+    def write(self, text):
+        self.queue.extend(_chunks(text))
+        self.drain(False)
+
+    def drain(self, wait):
+        queue = self.queue
+        while queue:
+            head = queue[0]
+            if isinstance(head, _Pending):
+                if not (wait or head.done()):
+                    break
+                head = head.result()
+            self.out.write(head)
+            queue.popleft()
+
+
+# Tags whose '_' handler in Stream only forwards to the public method
+_FORWARD = frozenset((
+    'headers', 'title', 'para', 'ordered', 'unordered', 'item', 'itembreak',
+    'text', 'embed', 'end'
+))
 
 
 class Stream(object):
@@ -8,36 +83,228 @@ class Stream(object):
         self.cord = cord
 
         self.map = {
-            tags.headers: self._headers,
+            tag: self._handler(tag.name) for tag in (
+                tags.headers,
 
-            tags.title: self._title,
-            tags.section: self._section,
-            tags.para: self._para,
+                tags.title,
+                tags.section,
+                tags.para,
 
-            tags.ordered: self._ordered,
-            tags.unordered: self._unordered,
-            tags.item: self._item,
-            tags.itembreak: self._itembreak,
+                tags.ordered,
+                tags.unordered,
+                tags.item,
+                tags.itembreak,
 
-            tags.text: self._text,
+                tags.text,
 
-            tags.embed: self._embed,
+                tags.embed,
 
-            tags.end: self._end
+                tags.end
+            )
         }
         self.sections = []
-
-    def dump(self, out):
-        for e in self.cord:
-            fn = self.map.get(e[0], None)
+        self.pool = None
+        self.tasks = None
+        self.limit = None
+        self.profile = None
+        self.shared = None
+
+    def _handler(self, name):
+        # Bind straight to the public method unless the '_' prefixed
+        # trampoline does something beyond forwarding.
+        trampoline = getattr(type(self), '_' + name)
+        if trampoline is getattr(Stream, '_' + name) and name in _FORWARD:
+            return getattr(self, name)
+        return getattr(self, '_' + name)
+
+    def dump(self, out, workers=None, profile=None):
+        if profile is not None:
+            return self._dump_profiled(out, workers, profile)
+        if workers:
+            return self._dump_concurrent(out, workers)
+
+        get = self._handlers(out)
+        write = out.write
+        join = u''.join
+        for e in self._events():
+            fn = get(e[0])
             if fn:
                 text = fn(*e[1:])
-                if text:
-                    out.write(u''.join(text))
+                if not text:
+                    continue
+                if e[0] is tags.embed:
+                    _write(write, text)
+                else:
+                    write(join(text))
             else:
                 self.unknown(e)
         self.end()
 
+    def _dump_profiled(self, out, workers, profile):
+        prev = profiling.active
+        self.profile = profiling.active = profile
+        start = time.perf_counter()
+        try:
+            self.dump(out, workers)
+        finally:
+            profile.wall += time.perf_counter() - start
+            self.profile = None
+            profiling.active = prev
+
+    def _events(self):
+        if self.profile is None:
+            return self.cord
+        return self.profile.cord(self.cord)
+
+    def _handlers(self, out):
+        handlers = self.map
+        if self.profile is not None:
+            prefix = type(self).__name__ + '.'
+            handlers = {
+                tag: self.profile.handler(prefix + fn.__name__, fn)
+                for tag, fn in handlers.items()
+            }
+
+        # Outputs with a boundary() method (e.g. stdio.Writer) are told
+        # whenever a new section begins.
+        boundary = getattr(out, 'boundary', None)
+        if not boundary:
+            return handlers.get
+
+        section = handlers[tags.section]
+
+        def _section(*args):
+            boundary()
+            return section(*args)
+
+        handlers = dict(handlers)
+        handlers[tags.section] = _section
+        return handlers.get
+
+    def _dump_concurrent(self, out, workers):
+        # Plugin work is submitted to the pool as embeds arrive, output is
+        # held back behind the first unfinished embed to keep document order.
+        queue = _Ordered(out)
+        with ThreadPoolExecutor(workers) as pool:
+            self.pool = pool
+            get = self._handlers(out)
+            try:
+                for e in self._events():
+                    fn = get(e[0])
+                    if fn:
+                        text = fn(*e[1:])
+                        if text:
+                            queue.write(text)
+                    else:
+                        self.unknown(e)
+                queue.drain(True)
+            finally:
+                self.pool = None
+        self.end()
+
+    async def adump(self, out, workers=None):
+        # dump() for use on an event loop: the cord is an async iterator of
+        # events (see aio.events) and the commands plugins run are run as
+        # subprocesses of the loop, at most `workers` at a time.
+        queue = deque()
+
+        async def drain(wait):
+            while queue:
+                head = queue[0]
+                if isinstance(head, _Pending):
+                    if not head.done():
+                        if not wait:
+                            break
+                        await head.future
+                    head = head.result()
+                out.write(head)
+                queue.popleft()
+
+        self.tasks = {}
+        self.limit = asyncio.Semaphore(workers) if workers else None
+        get = self._handlers(out)
+        try:
+            async for e in self.cord:
+                fn = get(e[0])
+                if fn:
+                    text = fn(*e[1:])
+                    if text:
+                        queue.extend(_chunks(text))
+                        await drain(False)
+                else:
+                    self.unknown(e)
+            await drain(True)
+        finally:
+            for item in queue:
+                if isinstance(item, _Pending):
+                    item.future.cancel()
+            for task in self.tasks.values():
+                task.cancel()
+            self.tasks = None
+            self.limit = None
+        self.end()
+
+    def _aplugin(self, plugin, fmts, headers, body, render):
+        with embed.deferred() as jobs:
+            result = plugin(fmts, headers, body)
+        if not jobs:
+            return render(*result)
+        return (_Pending(asyncio.ensure_future(self._arender(jobs, result)),
+                         render),)
+
+    async def _arender(self, jobs, result):
+        # The same output is only rendered once, however often it is used
+        tasks = self.tasks
+        for job in jobs:
+            if job[1] not in tasks:
+                tasks[job[1]] = asyncio.ensure_future(self._limited(job))
+        await asyncio.gather(*(tasks[job[1]] for job in jobs))
+        return result
+
+    async def _limited(self, job):
+        if self.limit is None:
+            return await embed.arender(*job)
+        async with self.limit:
+            return await embed.arender(*job)
+
+    def plugin(self, plugin, fmts, headers, body, render):
+        if self.tasks is not None:
+            return self._aplugin(plugin, fmts, headers, body, render)
+        if self.shared is None:
+            result = self._call(plugin, fmts, headers, body)
+        else:
+            result = self._shared(plugin, fmts, headers, body)
+        if self.pool is None:
+            return render(*result)
+        return (_Pending(result, render),)
+
+    def _call(self, plugin, fmts, headers, body):
+        if self.pool is None:
+            return plugin(fmts, headers, body)
+        return self.pool.submit(plugin, fmts, headers, body)
+
+    def _shared(self, plugin, fmts, headers, body):
+        # Streams driven by fanout() share the results for an embed: the
+        # plugin is only called again when none of the formats it produced
+        # so far is the one it would pick for fmts.
+        fmts = tuple(fmts)
+        calls = self.shared.setdefault(getattr(plugin, 'embed', plugin), [])
+        if self.pool is None:
+            result = _produced(fmts, calls)
+            if result is None:
+                result = plugin(fmts, headers, body)
+                calls.append((fmts, result))
+            return result
+        for asked, result in calls:
+            if asked == fmts:
+                return result
+        # earlier results are only known once their futures are done,
+        # which is waited for in the pool (they were submitted first)
+        result = self.pool.submit(_reuse, plugin, fmts, headers, body,
+                                  list(calls))
+        calls.append((fmts, result))
+        return result
+
     def _headers(self, headers):
         return self.headers(headers)
 
@@ -115,3 +382,80 @@ class Stream(object):
 
     def unknown(self, args):
         sys.stderr.write('Unknown tag %s\n' % (repr(args)))
+
+
+def _produced(fmts, calls):
+    # The result of an earlier call of a plugin that calling it for fmts
+    # would repeat. Plugins pick the first of the formats asked for that
+    # they can produce (see embed.accept), so the formats asked for before
+    # the one produced are known not to be.
+    declined = set()
+    results = {}
+    for asked, (fmt, fname) in calls:
+        if fmt in asked:
+            declined.update(asked[:asked.index(fmt)])
+        results[fmt] = (fmt, fname)
+    for fmt in fmts:
+        if fmt in results:
+            return results[fmt]
+        if fmt not in declined:
+            return None
+    return None
+
+
+def _reuse(plugin, fmts, headers, body, calls):
+    done = []
+    for asked, future in calls:
+        try:
+            done.append((asked, future.result()))
+        except Exception:
+            pass
+    result = _produced(fmts, done)
+    if result is None:
+        result = plugin(fmts, headers, body)
+    return result
+
+
+def fanout(cord, targets, workers=None):
+    # Drives several streams from a single pass over the events of cord.
+    # targets is a list of (stream, out) pairs, the streams being created
+    # without a cord of their own. An embed is handed to each plugin once
+    # per format it produces, however many streams want it.
+    pool = ThreadPoolExecutor(workers) if workers else None
+    sinks = []
+    for stream, out in targets:
+        stream.pool = pool
+        sinks.append((stream, stream._handlers(out),
+                      _Ordered(out) if pool else out))
+    try:
+        for e in cord:
+            if e[0] is tags.embed:
+                shared = {}
+                for stream, get, out in sinks:
+                    stream.shared = shared
+            for stream, get, out in sinks:
+                fn = get(e[0])
+                if not fn:
+                    stream.unknown(e)
+                    continue
+                text = fn(*e[1:])
+                if not text:
+                    continue
+                if pool is not None:
+                    out.write(text)
+                    continue
+                if e[0] is tags.embed:
+                    _write(out.write, text)
+                else:
+                    out.write(u''.join(text))
+        if pool:
+            for stream, get, out in sinks:
+                out.drain(True)
+    finally:
+        for stream, get, out in sinks:
+            stream.pool = None
+            stream.shared = None
+        if pool:
+            pool.shutdown()
+    for stream, get, out in sinks:
+        stream.end()
@@ -1,6 +1,13 @@
+# Tags by name
+TAGS = {}
+
+
 class Tag(object):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
+        TAGS[name] = self
 
     def __call__(self, *args):
         return (self,) + args
@@ -0,0 +1,167 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify(7)
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+# Directories are watched rather than the files themselves, so that files
+# replaced by a rename (as many editors save) are still followed.
+_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+         _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class _Inotify(object):
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = set()
+        self.dirs = {}
+        self.wds = {}
+
+    def watch(self, paths):
+        self.paths = set(paths)
+        dirs = set(os.path.dirname(p) or '.' for p in self.paths)
+        for d in set(self.dirs) - dirs:
+            wd = self.dirs.pop(d)
+            del self.wds[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+        for d in dirs - set(self.dirs):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), _MASK)
+            if wd >= 0:
+                self.dirs[d] = wd
+                self.wds[wd] = d
+
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + size].rstrip(b'\0')
+            pos += size
+            if mask & _IN_Q_OVERFLOW:
+                return set(self.paths)
+            d = self.wds.get(wd)
+            if d is None:
+                continue
+            path = os.path.join(d, os.fsdecode(name)) if d != '.' else \
+                os.fsdecode(name)
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poll(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.stamps = {}
+
+    def watch(self, paths):
+        # keep the stamps of files already known, so that changes made while
+        # the caller was busy are still seen
+        stamps = self.stamps
+        self.stamps = {p: stamps[p] if p in stamps else _stamp(p)
+                       for p in paths}
+
+    def read(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changed = set()
+            for p, known in self.stamps.items():
+                st = _stamp(p)
+                if st != known:
+                    self.stamps[p] = st
+                    changed.add(p)
+            if changed:
+                return changed
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return changed
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+
+def _backend(interval):
+    name = ctypes.util.find_library('c')
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+        return _Inotify(libc)
+    except (OSError, AttributeError):
+        return _Poll(interval)
+
+
+class Watcher(object):
+    # Waits for changes to a set of files, using inotify where available
+    # and polling every `interval` seconds otherwise. A burst of writes is
+    # reported once, after `delay` seconds without further changes.
+    def __init__(self, delay=0.1, interval=0.5, poll=False):
+        self.delay = delay
+        self.backend = _Poll(interval) if poll else _backend(interval)
+        self.names = {}
+
+    @property
+    def polling(self):
+        return isinstance(self.backend, _Poll)
+
+    def watch(self, paths):
+        self.names = {os.path.normpath(p): p for p in paths}
+        self.backend.watch(self.names)
+
+    def wait(self, timeout=None):
+        # Returns the changed paths, as given to watch(), or an empty set
+        # once `timeout` passes without changes.
+        changed = self.backend.read(timeout)
+        if changed:
+            while True:
+                more = self.backend.read(self.delay)
+                if not more:
+                    break
+                changed |= more
+        return set(self.names[p] for p in changed if p in self.names)
+
+    def close(self):
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()